@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot paths of the page conversion.
+
+Run with the name of one or more benchmarks (default all), for example:
+
+  python benchmarks.py dispatch convert
+
+Timings are the best of several repeats, so they are comparable between runs
+on the same machine.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import argparse, os, codecs, copy, time, timeit
+import visitor
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests")
+
+def best_time(func, number, repeat=5):
+    """ Return the best time in seconds of 'repeat' runs of calling func() 'number' times, per call """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def report(name, seconds):
+    if seconds < 1e-3:
+        print("  %-40s %10.3f us" % (name, seconds * 1e6))
+    else:
+        print("  %-40s %10.3f ms" % (name, seconds * 1e3))
+
+def read_test_pages():
+    """ Return a list of (title, mediawiki content) for each conversion test """
+    pages = []
+    for name in sorted(os.listdir(TESTS_DIR)):
+        path = os.path.join(TESTS_DIR, name, "mediawiki.txt")
+        if os.path.exists(path):
+            with codecs.open(path, "r", "utf-8") as f:
+                pages.append((name, f.read().strip()))
+    return pages
+
+def copy_tree(tree):
+    """ Return a deep copy of a parse tree (copying recurses once per level, like parsing) """
+    import wikicontent
+    wikicontent.allow_deep_parsing()
+    return copy.deepcopy(tree)
+
+class Node(object):
+    pass
+class Leaf(Node):
+    pass
+class SubLeaf(Leaf):
+    pass
+
+@visitor.is_visitor
+class Visitor(object):
+    @visitor.when(Node, allow_cascaded_calls=True)
+    def visit(self, node):
+        return 0
+
+    @visitor.when(Leaf)
+    def visit(self, node):
+        return 1
+
+@visitor.when(Node)
+def visit(node):
+    return 0
+
+@visitor.when(Leaf)
+def visit(node):
+    return 1
+
+def bench_dispatch():
+    """ Cost of a single visitor dispatch """
+    leaf, subleaf, v = Leaf(), SubLeaf(), Visitor()
+    report("function, exact type", best_time(lambda: visit(leaf), 100000))
+    report("function, subclass", best_time(lambda: visit(subleaf), 100000))
+    report("method, cascaded calls", best_time(lambda: v.visit(leaf), 100000))
+
+def bench_convert():
+    """ Converting the parse trees of the conversion tests to dokuwiki, without parsing them """
+    import wikicontent
+    trees = [ wikicontent.parse(title, content) for title, content in read_test_pages() ]
+    # converting modifies the parse trees, so each run converts fresh copies of them
+    number = 20
+    times = []
+    for i in range(5):
+        copies = [ copy_tree(trees) for n in range(number) ]
+        start = time.perf_counter()
+        for roots in copies:
+            for root in roots:
+                wikicontent.convert(root, { "list_stack" : [], "nowiki_plaintext" : [] }, False)
+        times.append((time.perf_counter() - start) / number)
+    report("convert %d test pages" % len(trees), min(times))
+
+def big_pages():
+    """ Return a list of (title, mediawiki content) for synthetic multi-megabyte pages """
+    table = "{|\n" + "".join("|-\n| cell %d || '''bold''' %d || [[Link %d]]\n" % (i, i, i) for i in range(40000)) + "|}\n"
+    items = "".join("* item %d with ''italics''\n** nested [[Page %d|link]]\n" % (i, i) for i in range(40000))
+    text = "".join("Paragraph %d of plain text with a [http://example.com/%d link].\n\n" % (i, i) for i in range(40000))
+    return [ ("Big table", table), ("Big list", items), ("Big text", text) ]
+
+def table_pages():
+    """ Return a list of (title, mediawiki content) for synthetic pages with and without many tables """
+    table = "{|\n" + "".join("|-\n| '''cell''' %d || ''italics'' || [[Kuva:Pic %d.png]] || {{Foo}}\n" % (i, i) for i in range(20)) + "|}\n"
+    tables = "".join("== Section %d ==\nText with [[Tiedosto:Doc %d.pdf]] and <nowiki>''raw''</nowiki>.\n%s" % (i, i, table) for i in range(500))
+    text = "".join("== Section %d ==\nParagraph %d with a [[Link]] and '''bold''' text.\n" % (i, i) for i in range(10000))
+    return [ ("Many tables", tables), ("No tables", text) ]
+
+def bench_preprocess():
+    """ pmw2dw pre- and post-processing of pages with and without many tables, without parsing them """
+    from pmw2dw import pmw2dw_args, pmw2dw_converter
+    converter = pmw2dw_converter(pmw2dw_args)
+    for title, content in table_pages():
+        report("%s (%.1f MB)" % (title, len(content) / 1e6), best_time(lambda: converter.post_process(*converter.pre_process(content, title)), 5))
+
+def bench_templates():
+    """ Replacing templates in a page with many of them, compared with a str.replace per template """
+    from pmw2dw import pmw2dw_args, pmw2dw_converter
+    converter = pmw2dw_converter(pmw2dw_args)
+    content = "".join("Text {{Template %d}} and {{Unknown %d|arg}} more text.\n" % (i % 100, i) for i in range(10000))
+    for count in (10, 1000, 10000):
+        converter.set_template_replacements({ "{{Template %d}}" % i : "{{template_%d.png}}" % i for i in range(count) })
+        def replace_each():
+            text = content
+            for old_templ, new_file in converter.template_replacements.items():
+                text = text.replace(old_templ, new_file)
+            return text
+        assert converter.replace_templates(content) == replace_each()
+        report("%d templates, replace_templates" % count, best_time(lambda: converter.replace_templates(content), 3, 3))
+        report("%d templates, str.replace each" % count, best_time(replace_each, 1, 3))
+
+def bench_bigpages():
+    """ Converting the parse trees of synthetic multi-megabyte pages to dokuwiki, without parsing them """
+    import wikicontent
+    for title, content in big_pages():
+        tree = wikicontent.parse(title, content)
+        times = []
+        for i in range(3):
+            root = copy_tree(tree)
+            start = time.perf_counter()
+            wikicontent.convert(root, { "list_stack" : [], "nowiki_plaintext" : [] }, False)
+            times.append(time.perf_counter() - start)
+        report("%s (%.1f MB)" % (title, len(content) / 1e6), min(times))
+
+def bench_names():
+    """ Converting mediawiki titles to dokuwiki ids, as done for every link, revision and user """
+    import dokuwiki, names
+    titles = [ "Some Page/Subpage %d" % i for i in range(5000) ]
+    def uncached():
+        names.clean_id.cache_clear()
+        dokuwiki.make_dokuwiki_pagename.cache_clear()
+        for t in titles:
+            dokuwiki.make_dokuwiki_pagename.__wrapped__(t)
+    report("make_dokuwiki_pagename, uncached", best_time(uncached, 10) / len(titles))
+    report("make_dokuwiki_pagename, memoized", best_time(lambda: [ dokuwiki.make_dokuwiki_pagename(t) for t in titles ], 10) / len(titles))
+    index = dokuwiki.TitleIndex()
+    index.add_all(titles)
+    report("TitleIndex.get", best_time(lambda: [ index.get(t) for t in titles ], 10) / len(titles))
+
+def bench_attic():
+    """ Writing gzipped attic revisions of a long page history, by compression level and number of threads """
+    import dokuwiki, tempfile, concurrent.futures
+    revisions = [ "".join("Line %d of revision %d, with some '''wiki''' text.\n" % (i, r) for i in range(500)) for r in range(200) ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for level in (9, 6, 1):
+            for threads in (1, 4):
+                def write_all():
+                    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+                        writes = [ pool.submit(dokuwiki.write_attic, os.path.join(tmpdir, "%d.txt.gz" % r), content, 1000000000 + r, level)
+                                   for r, content in enumerate(revisions) ]
+                        for write in writes:
+                            write.result()
+                report("%d revisions, level %d, %d threads" % (len(revisions), level, threads), best_time(write_all, 1, 3))
+
+def bench_pagecontent():
+    """ Full conversion (parsing included) of the conversion tests """
+    import wikicontent
+    pages = read_test_pages()
+    def convert_all():
+        for title, content in pages:
+            wikicontent.convert_pagecontent(title, content)
+    report("convert_pagecontent %d test pages" % len(pages), best_time(convert_all, 5))
+
+BENCHMARKS = {
+    "dispatch" : bench_dispatch,
+    "convert" : bench_convert,
+    "pagecontent" : bench_pagecontent,
+    "names" : bench_names,
+    "attic" : bench_attic,
+    "preprocess" : bench_preprocess,
+    "templates" : bench_templates,
+    "bigpages" : bench_bigpages,
+}
+
+def main():
+    args = arguments.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            arguments.error("unknown benchmark '%s' (choose from %s)" % (name, ", ".join(sorted(BENCHMARKS))))
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print("%s: %s" % (name, BENCHMARKS[name].__doc__.strip()))
+        BENCHMARKS[name]()
+
+arguments = argparse.ArgumentParser(description='Run yamdwe micro-benchmarks')
+arguments.add_argument('benchmarks', metavar='BENCHMARK', nargs='*', help="Benchmarks to run: %s (default all)" % ", ".join(sorted(BENCHMARKS)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Maintains dokuwiki's wiki-wide changes logs, meta/_dokuwiki.changes and
+media_meta/_media.changes, which list every change in the wiki sorted by time.
+
+Change lines are recorded as the per-page .changes files are written, and then
+merged into the existing wiki-wide log in one streaming pass. The log is only
+rebuilt from every .changes file when there isn't a usable one, and then with a
+streaming merge of the (already sorted) per-page files.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, heapq, tempfile
+
+# number of new change lines held in memory before they are sorted and spilled to a temporary file
+RUN_LINES = 100000
+# maximum number of files merged at once
+MERGE_FILES = 256
+
+class ChangesLog(object):
+    """
+    The wiki-wide changes log 'aggregate' in 'metadir'. Records the change lines
+    written to the .changes files under 'metadir' until write() merges them in.
+
+    If 'rebuild' is set then write() rebuilds the log from all the .changes files,
+    as it also does if there is no existing log.
+    """
+    def __init__(self, metadir, aggregate, rebuild=False):
+        self.metadir = metadir
+        self.path = os.path.join(metadir, aggregate)
+        self.rebuild = rebuild or not os.path.exists(self.path)
+        self.lines = []
+        self.runs = []
+        self.replaced = set()
+
+    def replace(self, changes_id):
+        """
+        Record that the .changes file of the page or media file 'changes_id' is being
+        written from scratch, so its existing entries are dropped from the log.
+        """
+        if changes_id in self.replaced:
+            # lines already recorded for it this time are stale too, so start afresh
+            self.rebuild = True
+        self.replaced.add(changes_id)
+
+    def add(self, line):
+        """ Record a change 'line' as written to a .changes file, including its line ending """
+        if self.rebuild:
+            return
+        self.lines.append(line.encode("utf-8"))
+        if len(self.lines) >= RUN_LINES:
+            self.runs.append(write_run(self.metadir, sorted(self.lines, key=line_timestamp)))
+            self.lines = []
+
+    def write(self):
+        """ Write the wiki-wide log with all the recorded changes merged in """
+        try:
+            if self.rebuild:
+                rebuild_changes_log(self.metadir, self.path)
+                return
+            with open(self.path, "rb") as existing:
+                kept = (line for line in existing if line_id(line) not in self.replaced)
+                runs = [ open(run, "rb") for run in self.runs ]
+                try:
+                    write_merged(self.path, [ kept ] + runs + [ sorted(self.lines, key=line_timestamp) ])
+                finally:
+                    for run in runs:
+                        run.close()
+        finally:
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+            self.lines = []
+
+def rebuild_changes_log(metadir, path):
+    """
+    Rebuild the wiki-wide changes log at 'path' from all the .changes files under 'metadir'.
+
+    This is a streaming version of https://www.dokuwiki.org/tips:Recreate_Wiki_Change_Log:
+    each .changes file is already sorted, so they are merged MERGE_FILES at a time and
+    never all held in memory.
+    """
+    aggregate = os.path.basename(path)
+    files = []
+    for root, dirs, names in os.walk(metadir):
+        for changesfile in names:
+            if changesfile == aggregate or not changesfile.endswith(".changes"):
+                continue
+            files.append(os.path.join(root, changesfile))
+    runs = []
+    try:
+        while len(files) > MERGE_FILES:
+            # merge groups of files into temporary runs (the first groups stay first, so equal timestamps keep their order)
+            merged = []
+            for i in range(0, len(files), MERGE_FILES):
+                handle, run = tempfile.mkstemp(suffix=".tmp", dir=metadir)
+                os.close(handle)
+                merge_files(files[i:i + MERGE_FILES], run)
+                merged.append(run)
+            runs += merged
+            files = merged
+        merge_files(files, path)
+    finally:
+        for run in runs:
+            os.remove(run)
+
+def merge_files(paths, path):
+    """ Write the lines of the sorted files 'paths' to 'path', merged in time order """
+    inputs = [ open(p, "rb") for p in paths ]
+    try:
+        write_merged(path, inputs)
+    finally:
+        for f in inputs:
+            f.close()
+
+def write_merged(path, sources):
+    """ Atomically write the lines of each of the (sorted) iterables 'sources' to 'path', merged in time order """
+    with open(path + ".tmp", "wb") as f:
+        f.writelines(heapq.merge(*sources, key=line_timestamp))
+    os.replace(path + ".tmp", path)
+
+def write_run(metadir, lines):
+    """ Write the sorted 'lines' to a new temporary file in 'metadir', returning its path """
+    handle, run = tempfile.mkstemp(suffix=".tmp", dir=metadir)
+    with os.fdopen(handle, "wb") as f:
+        f.writelines(lines)
+    return run
+
+def line_timestamp(line):
+    return int(line.split(b"\t", 1)[0])
+
+def line_id(line):
+    """ The page or media id a change line is for, as a string """
+    fields = line.split(b"\t", 4)
+    return fields[3].decode("utf-8") if len(fields) > 3 else None
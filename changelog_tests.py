@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Tests for maintaining dokuwiki's wiki-wide changes log.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, shutil, tempfile, unittest
+import changelog
+
+def change(timestamp, page, summary="edit"):
+    return "%d\t::1\tE\t%s\tuser\t%s\t\t1\n" % (timestamp, page, summary)
+
+class ChangesLogTests(unittest.TestCase):
+    def setUp(self):
+        self.metadir = tempfile.mkdtemp()
+        self.aggregate = os.path.join(self.metadir, "_dokuwiki.changes")
+
+    def tearDown(self):
+        shutil.rmtree(self.metadir)
+
+    def write_changes(self, page, lines):
+        """ Write the .changes file of 'page', as the exporter does """
+        path = os.path.join(self.metadir, "%s.changes" % page.replace(":", "/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    def export(self, pages, rebuild=False):
+        """ Write the .changes files of 'pages' (a dict of page to lines) and record them in the log """
+        log = changelog.ChangesLog(self.metadir, "_dokuwiki.changes", rebuild)
+        for page, lines in pages.items():
+            self.write_changes(page, lines)
+            log.replace(page)
+            for line in lines:
+                log.add(line)
+        log.write()
+
+    def read_log(self):
+        with open(self.aggregate, "r", encoding="utf-8") as f:
+            return f.readlines()
+
+    def test_first_export_rebuilds(self):
+        self.export({ "a" : [ change(1, "a"), change(4, "a") ], "ns:b" : [ change(2, "ns:b"), change(3, "ns:b") ] })
+        self.assertEqual(self.read_log(), [ change(1, "a"), change(2, "ns:b"), change(3, "ns:b"), change(4, "a") ])
+
+    def test_merge_new_changes(self):
+        self.export({ "a" : [ change(1, "a"), change(5, "a") ] })
+        self.export({ "b" : [ change(2, "b"), change(6, "b") ] })
+        self.assertEqual(self.read_log(), [ change(1, "a"), change(2, "b"), change(5, "a"), change(6, "b") ])
+
+    def test_replaced_page_drops_old_entries(self):
+        self.export({ "a" : [ change(1, "a"), change(3, "a", "old") ], "b" : [ change(2, "b") ] })
+        self.export({ "a" : [ change(1, "a"), change(4, "a", "new") ] })
+        self.assertEqual(self.read_log(), [ change(1, "a"), change(2, "b"), change(4, "a", "new") ])
+
+    def test_page_replaced_twice_rebuilds(self):
+        self.export({ "a" : [ change(1, "a") ] })
+        log = changelog.ChangesLog(self.metadir, "_dokuwiki.changes")
+        for lines in ([ change(2, "a", "first") ], [ change(3, "a", "second") ]):
+            self.write_changes("a", lines)
+            log.replace("a")
+            for line in lines:
+                log.add(line)
+        log.write()
+        self.assertEqual(self.read_log(), [ change(3, "a", "second") ])
+
+    def test_spilled_runs(self):
+        old_run_lines = changelog.RUN_LINES
+        changelog.RUN_LINES = 3
+        try:
+            self.export({ "a" : [ change(0, "a") ] })
+            pages = dict(("p%d" % i, [ change(i, "p%d" % i), change(20 - i, "p%d" % i) ]) for i in range(1, 8))
+            self.export(pages)
+        finally:
+            changelog.RUN_LINES = old_run_lines
+        timestamps = [ int(line.split("\t")[0]) for line in self.read_log() ]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(len(timestamps), 15)
+        self.assertEqual([ name for name in os.listdir(self.metadir) if name.endswith(".tmp") ], [])
+
+    def test_rebuild_merges_in_groups(self):
+        old_merge_files = changelog.MERGE_FILES
+        changelog.MERGE_FILES = 2
+        try:
+            pages = dict(("p%d" % i, [ change(i, "p%d" % i), change(20 - i, "p%d" % i) ]) for i in range(1, 8))
+            self.export(pages, rebuild=True)
+        finally:
+            changelog.MERGE_FILES = old_merge_files
+        timestamps = [ int(line.split("\t")[0]) for line in self.read_log() ]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(len(timestamps), 14)
+        self.assertEqual([ name for name in os.listdir(self.metadir) if name.endswith(".tmp") ], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Persistent, content-addressed cache of converted page content.
+
+Re-running an export usually converts mostly the same revisions again. The cache
+stores the dokuwiki content produced for each revision (pmw2dw pre-processing,
+mwlib conversion and post-processing) in an SQLite database, keyed on a hash of
+the revision's wikitext, its page title and everything else the result depends
+on, so unchanged revisions don't need to be parsed again.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import sqlite3, hashlib, inspect, json, time, importlib.metadata
+import wikicontent, visitor, names, pmw2dw, dokuwiki
+
+# commit new entries (and the use of existing ones) to the database after this many have been added or used
+COMMIT_INTERVAL = 1000
+
+class ConversionCache(object):
+    """
+    Cache stored in the SQLite database file 'path'. If 'max_size' is non-zero, the least
+    recently used entries are evicted at close() until the content stored is under this
+    many bytes.
+
+    'converter' is the pmw2dw converter in use, its settings become part of every key.
+    """
+    def __init__(self, path, max_size, converter):
+        self.max_size = max_size
+        self.fingerprint = conversion_fingerprint(converter)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS conversions (key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS conversions_used ON conversions (used)")
+        self.hits = 0
+        self.misses = 0
+        self.uncommitted = 0
+        self.used_keys = []
+
+    def _key(self, title, text):
+        key = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        key.update(title.encode("utf-8") + b"\0")
+        key.update(text.encode("utf-8"))
+        return key.hexdigest()
+
+    def get(self, title, text):
+        """ Return the cached converted content for 'text' on page 'title', or None """
+        key = self._key(title, text)
+        row = self.db.execute("SELECT content FROM conversions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_keys.append(key)
+        if len(self.used_keys) >= COMMIT_INTERVAL:
+            self._record_used()
+            self.db.commit()
+            self.uncommitted = 0
+        return row[0]
+
+    def put(self, title, text, content):
+        """ Store the converted 'content' for 'text' on page 'title' """
+        self.db.execute("INSERT OR REPLACE INTO conversions (key, content, size, used) VALUES (?, ?, ?, ?)",
+                        (self._key(title, text), content, len(content.encode("utf-8")), time.time()))
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def _record_used(self):
+        """ Record the entries returned by get() since this was last done as used now """
+        now = time.time()
+        self.db.executemany("UPDATE conversions SET used = ? WHERE key = ?", ((now, key) for key in self.used_keys))
+        self.used_keys = []
+
+    def close(self):
+        """ Record which entries were used, evict old entries if over max_size, and print statistics """
+        self._record_used()
+        evicted = 0
+        if self.max_size:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM conversions").fetchone()[0]
+            if total > self.max_size:
+                evict = []
+                for key, size in self.db.execute("SELECT key, size FROM conversions ORDER BY used"):
+                    if total <= self.max_size:
+                        break
+                    evict.append((key,))
+                    total -= size
+                self.db.executemany("DELETE FROM conversions WHERE key = ?", evict)
+                evicted = len(evict)
+        self.db.commit()
+        self.db.close()
+        print("Conversion cache: %d hits, %d misses, %d entries evicted." % (self.hits, self.misses, evicted))
+
+def conversion_fingerprint(converter):
+    """
+    Return a string identifying everything besides the page title and text that
+    the converted content depends on: the converter code itself, the pmw2dw settings
+    and template replacements, and the wiki's file namespace aliases.
+    """
+    sources = [ inspect.getsource(module) for module in (wikicontent, visitor, names, pmw2dw) ]
+    sources += [ inspect.getsource(func) for func in (dokuwiki.convert_revision, dokuwiki.make_dokuwiki_pagename,
+                                                      dokuwiki.make_dokuwiki_heading_id) ]
+    settings = dict((key, value) for key, value in vars(converter.args).items() if not key.startswith("__"))
+    fingerprint = {
+        "code" : hashlib.sha256("\0".join(sources).encode("utf-8")).hexdigest(),
+        "mwlib" : mwlib_version(),
+        "settings" : repr(sorted(settings.items())),
+        "templates" : json.dumps(converter.template_replacements, sort_keys=True),
+        "file_namespace" : wikicontent.dw_file_namespace,
+        "file_namespace_aliases" : wikicontent.mw_file_namespace_aliases.pattern,
+        }
+    return json.dumps(fingerprint, sort_keys=True)
+
+def mwlib_version():
+    try:
+        return importlib.metadata.version("mwlib")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
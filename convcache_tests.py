@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Tests for the persistent cache of converted page content.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import io, os, shutil, tempfile, unittest, contextlib, itertools
+import convcache
+
+class DummyArgs(object):
+    """ pmw2dw settings, overridden in a subclass per DummyConverter """
+    keep_tables = True
+    template_replacements_filename = None
+
+class DummyConverter(object):
+    """ Stands in for the pmw2dw converter, which only contributes its settings and template replacements """
+    def __init__(self, template_replacements=None, **settings):
+        self.args = type("Args", (DummyArgs,), settings)
+        self.template_replacements = template_replacements or {}
+
+class FakeClock(object):
+    """ Replaces the time module in convcache, so every entry is used at a distinct time """
+    def __init__(self):
+        self.ticks = itertools.count(1)
+
+    def time(self):
+        return float(next(self.ticks))
+
+class ConversionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "yamdwe.cache")
+        self.real_time = convcache.time
+        convcache.time = FakeClock()
+
+    def tearDown(self):
+        convcache.time = self.real_time
+        shutil.rmtree(self.tmpdir)
+
+    def open(self, converter=None, max_size=0):
+        return convcache.ConversionCache(self.path, max_size, converter or DummyConverter())
+
+    def close(self, cache):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            cache.close()
+        return output.getvalue()
+
+    def test_hit_and_miss(self):
+        cache = self.open()
+        self.assertIsNone(cache.get("Page", "'''text'''"))
+        cache.put("Page", "'''text'''", "**text**")
+        self.assertEqual(cache.get("Page", "'''text'''"), "**text**")
+        self.assertIsNone(cache.get("Page", "''text''"))
+        self.assertIsNone(cache.get("Other page", "'''text'''")) # titles are part of the key
+        self.assertEqual(self.close(cache), "Conversion cache: 1 hits, 3 misses, 0 entries evicted.\n")
+
+    def test_persists(self):
+        cache = self.open()
+        cache.put("Page", "text", "converted")
+        self.close(cache)
+        cache = self.open()
+        self.assertEqual(cache.get("Page", "text"), "converted")
+        self.close(cache)
+
+    def test_settings_change_invalidates(self):
+        cache = self.open(DummyConverter())
+        cache.put("Page", "text", "converted")
+        self.close(cache)
+        cache = self.open(DummyConverter(keep_tables=False))
+        self.assertIsNone(cache.get("Page", "text"))
+        self.close(cache)
+        cache = self.open(DummyConverter())
+        self.assertEqual(cache.get("Page", "text"), "converted")
+        self.close(cache)
+
+    def test_template_change_invalidates(self):
+        templates = { "{{Foo}}" : "{{foo.png}}" }
+        cache = self.open(DummyConverter(templates))
+        cache.put("Page", "{{Foo}}", "{{foo.png}}")
+        self.close(cache)
+        cache = self.open(DummyConverter({ "{{Foo}}" : "{{bar.png}}" }))
+        self.assertIsNone(cache.get("Page", "{{Foo}}"))
+        self.close(cache)
+        cache = self.open(DummyConverter(dict(templates)))
+        self.assertEqual(cache.get("Page", "{{Foo}}"), "{{foo.png}}")
+        self.close(cache)
+
+    def test_evicts_least_recently_used(self):
+        cache = self.open()
+        for name in "ABCD":
+            cache.put(name, "text", "x" * 10)
+        self.assertEqual(cache.get("A", "text"), "x" * 10) # now the most recently used
+        self.close(cache)
+        cache = self.open(max_size=25)
+        self.assertEqual(self.close(cache), "Conversion cache: 0 hits, 0 misses, 2 entries evicted.\n")
+        cache = self.open()
+        self.assertEqual([ name for name in "ABCD" if cache.get(name, "text") ], [ "A", "D" ])
+        self.close(cache)
+
+    def test_no_eviction_under_max_size(self):
+        cache = self.open(max_size=100)
+        for name in "ABCD":
+            cache.put(name, "text", "x" * 10)
+        self.assertEqual(self.close(cache), "Conversion cache: 0 hits, 0 misses, 0 entries evicted.\n")
+
+    def test_use_recorded_in_batches(self):
+        cache = self.open()
+        cache.put("A", "text", "converted")
+        for i in range(convcache.COMMIT_INTERVAL - 1):
+            cache.get("A", "text")
+        self.assertEqual(len(cache.used_keys), convcache.COMMIT_INTERVAL - 1)
+        cache.get("A", "text")
+        self.assertEqual(cache.used_keys, [])
+        self.close(cache)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,15 +7,19 @@ Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
 #from __future__ import print_function, unicode_literals, absolute_import, division
-import os, os.path, gzip, shutil, re, requests, calendar, codecs, sys
+import os, os.path, gzip, shutil, re, requests, calendar, codecs, sys, collections, contextlib, functools, hashlib, concurrent.futures
 from requests.auth import HTTPBasicAuth
 import wikicontent
 import simplemediawiki
 import names
+import convcache
+import changelog
+import media
+import workqueue
 from pmw2dw import pmw2dw_args, pmw2dw_converter
 
 class Exporter(object):
-    def __init__(self, rootpath):
+    def __init__(self, rootpath, jobs=1, attic_compresslevel=9, attic_dedup="page"):
 
         # verify the dokuwiki rootpath exists
         self.root = rootpath
@@ -34,54 +38,305 @@ class Exporter(object):
         for subdir in [ self.meta, self.attic, self.pages]:
             ensure_directory_exists(subdir)
         self.pmw2dw_conv = pmw2dw_converter(pmw2dw_args)
+        # number of worker processes used to convert page content
+        self.jobs = jobs
+        self.cache = None
+        # optional runstate.Checkpoint, to record progress and skip what an interrupted export already wrote
+        self.checkpoint = None
+        # changelog.ChangesLog recording the page changes written by write_pages
+        self.changes_log = None
+        # directories files have been written to, for fixup_permissions
+        self.written_dirs = set()
+        # dokuwiki ids of the pages being exported
+        self.titles = TitleIndex("pages")
+        # gzip level of the attic revisions, which write_pages compresses on a pool of threads
+        self.attic_compresslevel = attic_compresslevel
+        self.attic_pool = None
+        # (page, [ Future ], attic files) of the pages whose attic revisions are still being written
+        self.attic_pending = collections.deque()
+        # attic revisions identical to one already written are hardlinked to it: "none", "page" (within
+        # a page's history) or "wiki" (across all pages, using attic_index of SHA-1 hash to (path, Future))
+        self.attic_dedup = attic_dedup
+        self.attic_index = {}
+        self.attic_links = 0
 
-    def write_pages(self, pages):
+    def use_cache(self, path, max_size=0):
         """
-        Given 'pages' as a list of mediawiki pages with revisions attached, export them to dokuwiki pages
+        Keep converted page content in a persistent ConversionCache at 'path', limited to
+        'max_size' bytes (0 for no limit.)
+
+        Must be called after the file namespaces are set in wikicontent, as they are part of the cache key.
+        """
+        self.cache = convcache.ConversionCache(path, max_size, self.pmw2dw_conv)
+
+    def write_pages(self, pages, incremental=False):
+        """
+        Given 'pages' as a list (or generator) of mediawiki pages with revisions attached, export them to dokuwiki pages
+
+        Each page is written out before the next one is taken from 'pages', so a generator
+        only ever needs to hold a single page history in memory.
+
+        If 'incremental' is set then revisions already exported to an existing dokuwiki page
+        are skipped, and only newer revisions are appended to the page's history.
+        """
+        if incremental:
+            pages = (page for page in map(self._only_new_revisions, pages) if page is not None)
+        if self.checkpoint is not None:
+            pages = (page for page in pages if not self.checkpoint.page_done(page))
+        # pages skipped on resume had their changes written by an earlier run, so rebuild the whole log
+        resumed = self.checkpoint is not None and self.checkpoint.resumed_pages
+        self.changes_log = changelog.ChangesLog(self.meta, "_dokuwiki.changes", rebuild=resumed)
+        self.written_dirs.add(self.meta)
+        self.attic_pool = concurrent.futures.ThreadPoolExecutor(max(1, self.jobs))
+        try:
+            if self.jobs > 1:
+                self._write_pages_parallel(pages)
+            else:
+                for page in pages:
+                    self._convert_page(page)
+            self._finish_attic_writes()
+        finally:
+            self.attic_pool.shutdown()
+            self.attic_pool = None
+        if self.attic_links:
+            print("%d attic revisions were hardlinked to identical revisions." % self.attic_links)
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        self.changes_log.write()
+        self.changes_log = None
+        self.titles.print_collisions()
+        if self.checkpoint is not None:
+            self.checkpoint.record_phase("pages")
+
+    def _write_pages_parallel(self, pages):
+        """
+        Convert the revisions of 'pages' on a pool of worker processes, while writing
+        the converted pages out in order from this process.
+
+        Only a bounded number of pages are converted ahead of the page being written.
+        """
+        initargs = (wikicontent.dw_file_namespace, wikicontent.mw_file_namespace_aliases, wikicontent.title_index, pmw2dw_args)
+        with concurrent.futures.ProcessPoolExecutor(self.jobs, initializer=_init_conversion_worker, initargs=initargs) as pool:
+            start = lambda page: self._start_conversion(page, pool)
+            with contextlib.closing(workqueue.run_ahead(start, pages, self.jobs * 2)) as started:
+                for page, results in started:
+                    self._convert_page(page, self._finish_conversion(page, results))
+
+    def _start_conversion(self, page, pool=None):
+        """
+        Start converting the content of each revision of 'page', oldest first.
+
+        Returns a list holding either the converted content (if it was found in the cache, or
+        there is no worker 'pool' so it was converted here) or a Future for it from the pool.
+        Revisions with the same text as an earlier one (reverts) share its result.
+        """
+        full_title = self.titles.add(page['title'])
+        results = []
+        converted = {}
+        for revision in reversed(page["revisions"]):
+            if revision["*"] in converted:
+                results.append(converted[revision["*"]])
+                continue
+            content = None
+            if self.cache is not None:
+                content = self.cache.get(page['title'], revision["*"])
+            if content is not None:
+                results.append(content)
+            elif pool is not None:
+                results.append(pool.submit(_convert_revision_in_worker, page['title'], full_title, revision["*"], get_timestamp(revision)))
+            else:
+                content = convert_revision(self.pmw2dw_conv, page['title'], full_title, revision["*"], get_timestamp(revision))
+                if self.cache is not None:
+                    self.cache.put(page['title'], revision["*"], content)
+                results.append(content)
+            converted[revision["*"]] = results[-1]
+        return results
+
+    def _finish_conversion(self, page, results):
         """
-        for page in pages:
-            self._convert_page(page)
-        self._aggregate_changes(self.meta, "_dokuwiki.changes")
+        Given the list returned by _start_conversion, wait for any conversions still running
+        in the worker pool and return the list of converted content.
+        """
+        contents = []
+        finished = {}
+        for revision, result in zip(reversed(page["revisions"]), results):
+            if isinstance(result, concurrent.futures.Future):
+                if result not in finished:
+                    finished[result] = result.result()
+                    if self.cache is not None:
+                        self.cache.put(page['title'], revision["*"], finished[result])
+                result = finished[result]
+            contents.append(result)
+        return contents
 
-    def write_images(self, images, file_namespace, http_user=None, http_pass=None):
+    def write_images(self, images, file_namespace, http_user=None, http_pass=None, session=None, workers=1, timeout=None, retries=0,
+                     images_dir=None, link_images=False):
         """
         Given 'images' as a list of mediawiki image metadata API entries,
         download and write out dokuwiki images. Does not bring over revisions.
 
         Images are all written to the file_namespace specified (file: by default), to match mediawiki.
+
+        Up to 'workers' images are downloaded at once. If a requests 'session' is given then its
+        (keep-alive) connections are used for the downloads, 'timeout' is the timeout for each.
+        Failed downloads are resumed up to 'retries' times, with exponential backoff.
+
+        If 'images_dir' is given then images are copied from this local mediawiki images directory
+        instead of being downloaded, or hardlinked if 'link_images' is set (leaving the modification
+        time of the mediawiki file untouched.) Only images which already have the permissions and
+        ownership of the data directory are hardlinked, others are copied, so that fixup_permissions
+        never changes the mediawiki's own files.
+
+        Images whose 'sha1' matches the file already written are not downloaded again, and images
+        with the same 'sha1' as another image are hardlinked to it.
         """
-        auth=None if http_user is None else HTTPBasicAuth(http_user, http_pass)
+        if images_dir is not None:
+            transfers = media.LocalCopier(workers, link_images, os.stat(self.data))
+        else:
+            auth=None if http_user is None else HTTPBasicAuth(http_user, http_pass)
+            transfers = media.Downloader(session, auth, workers, timeout, retries)
+        index = media.MediaIndex(os.path.join(self.data, "yamdwe.media_index"))
         file_namespace = file_namespace.lower()
         filedir = os.path.join(self.data, "media", file_namespace)
         ensure_directory_exists(filedir)
         filemeta = os.path.join(self.data, "media_meta", file_namespace)
         ensure_directory_exists(filemeta)
-        for image in images:
-            # download the image from the Mediawiki server
-            print("Downloading %s... (%s)" % (image['name'], image['url']))
-            r = requests.get(image['url'], auth=auth)
-            # write the actual image out to the data/file directory
-            name = make_dokuwiki_pagename(image['name'])
-            imagepath = os.path.join(filedir, name)
-            with open(imagepath, "wb") as f:
-                f.write(r.content)
-            # set modification time appropriately
+        self.written_dirs.update((filedir, filemeta, os.path.dirname(filemeta)))
+        counts = collections.Counter()
+        image_ids = TitleIndex("images")
+        image_ids.add_all(image['name'] for image in images)
+        resumed = self.checkpoint is not None and self.checkpoint.resumed_images
+        changes_log = changelog.ChangesLog(os.path.join(self.data, "media_meta"), "_media.changes", rebuild=resumed)
+
+        def finish(image, imagepath, set_time=True):
+            name = os.path.basename(imagepath)
             timestamp = get_timestamp(image)
-            os.utime(imagepath, (timestamp,timestamp))
+            # set modification time appropriately (a hardlink keeps that of the file it shares)
+            if set_time:
+                os.utime(imagepath, (timestamp,timestamp))
+            if image.get('sha1'):
+                index.record(imagepath, image['sha1'])
             # write a .changes file out to the media_meta/file directory
             changepath = os.path.join(filemeta, "%s.changes" % name)
             with codecs.open(changepath, "w", "utf-8") as f:
                 fields = (str(timestamp), "::1", "C", u"%s:%s"%(file_namespace,name), "", "created")
-                f.write(u"\t".join(fields) + "\r\n")
+                line = u"\t".join(fields) + "\r\n"
+                f.write(line)
+            changes_log.replace(fields[3])
+            changes_log.add(line)
+            if self.checkpoint is not None:
+                self.checkpoint.record_image(image)
+
+        def reuse_existing(image, imagepath):
+            """ Write 'image' without transferring it if its content is already on disk, returning True if so """
+            sha1 = image.get('sha1')
+            if index.unchanged(imagepath, sha1):
+                counts["unchanged"] += 1
+                finish(image, imagepath, set_time=False)
+                return True
+            source = index.find(sha1) if sha1 else None
+            if source is not None:
+                print("Linking %s to identical %s..." % (image['name'], os.path.basename(source)))
+                linked = media.link_or_copy(source, imagepath)
+                counts["linked"] += 1
+                finish(image, imagepath, set_time=not linked)
+                return True
+            return False
+
+        def transfer(image, imagepath):
+            if images_dir is not None:
+                source = media.local_image_path(images_dir, image['name'])
+                print("Copying %s... (%s)" % (image['name'], source))
+            else:
+                # download the image from the Mediawiki server to the data/file directory
+                source = image['url']
+                print("Downloading %s... (%s)" % (image['name'], source))
+            return source, imagepath, image.get('size'), image.get('sha1'), image
+
+        duplicates = []
+        def transfers_needed():
+            downloading = set()
+            for image in images:
+                if self.checkpoint is not None and self.checkpoint.image_done(image):
+                    continue
+                imagepath = os.path.join(filedir, image_ids.get(image['name']))
+                if reuse_existing(image, imagepath):
+                    continue
+                if image.get('sha1') in downloading:
+                    duplicates.append((image, imagepath)) # link once the first copy is written
+                    continue
+                if image.get('sha1'):
+                    downloading.add(image['sha1'])
+                yield transfer(image, imagepath)
+
+        def duplicate_transfers():
+            for image, imagepath in duplicates:
+                if not reuse_existing(image, imagepath):
+                    yield transfer(image, imagepath)
+
+        for items in (transfers_needed(), duplicate_transfers()):
+            for image, error in transfers.transfer_all(items):
+                if error is not None:
+                    print("Failed to write %s: %s" % (image['name'], error))
+                    continue
+                imagepath = os.path.join(filedir, image_ids.get(image['name']))
+                finish(image, imagepath, set_time=not (link_images and os.stat(imagepath).st_nlink > 1))
+        index.save()
+        print("%d images were unchanged and %d were linked to identical images." % (counts["unchanged"], counts["linked"]))
+        transfers.print_summary()
+        image_ids.print_collisions()
         # aggregate all the new changes to the media_meta/_media.changes file
-        self._aggregate_changes(os.path.join(self.data, "media_meta"), "_media.changes")
+        changes_log.write()
+        # failed images are left out of the checkpoint, so --resume tries them again
+        if self.checkpoint is not None and not transfers.failures:
+            self.checkpoint.record_phase("images")
+
+    def _only_new_revisions(self, page):
+        """
+        Return 'page' with only the revisions newer than the newest one already recorded in its
+        dokuwiki .changes file, or None if there are no newer revisions.
+
+        The returned page has a 'previous_size' entry, the size of the existing current revision
+        (the sum of all size changes recorded), so that new revisions are appended to the history.
+        A page which doesn't exist in dokuwiki yet is returned unchanged, unless it has no revisions
+        at all (such as a page deleted from the mediawiki.)
+        """
+        full_title = self.titles.add(page['title'])
+        if not page["revisions"]:
+            print("No new revisions of page '%s'..." % page['title'])
+            return None
+        changespath = os.path.join(self.meta, "%s.changes" % full_title.replace(':','/'))
+        if not os.path.exists(changespath):
+            return page
+        last_timestamp = 0
+        size = 0
+        with codecs.open(changespath, "r", "utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\r\n").split("\t")
+                last_timestamp = max(last_timestamp, int(fields[0]))
+                if len(fields) > 7 and fields[7]:
+                    size += int(fields[7])
+        revisions = [ revision for revision in page["revisions"] if get_timestamp(revision) > last_timestamp ]
+        if not revisions:
+            print("No new revisions of page '%s'..." % page['title'])
+            return None
+        return dict(page, revisions=revisions, previous_size=size)
 
-    def _convert_page(self, page):
-        """ Convert the supplied mediawiki page to a Dokuwiki page """
+    def _convert_page(self, page, contents=None):
+        """ Convert the supplied mediawiki page to a Dokuwiki page
+
+        'contents' is an optional list of the already converted content of each revision,
+        oldest first. If it isn't supplied then the revisions are converted here.
+        """
         print("Converting %d revisions of page '%s'..." %
               (len(page["revisions"]), page['title']))
+        if not page["revisions"]:
+            # nothing to write (a dump can have pages without revisions), but it still counts as done
+            self.attic_pending.append((page, [], {}))
+            return
         # Sanitise the mediawiki pagename to something matching the dokuwiki pagename convention
-        full_title = make_dokuwiki_pagename(page['title'])
+        full_title = self.titles.add(page['title'])
 
         # Mediawiki pagenames can contain namespace :s, convert these to dokuwiki / paths on the filesystem (becoming : namespaces in dokuwiki)
         subdir, pagename = os.path.split(full_title.replace(':','/'))
@@ -89,83 +344,131 @@ class Exporter(object):
         metadir = os.path.join(self.meta, subdir)
         atticdir = os.path.join(self.attic, subdir)
         for d in pagedir, metadir, atticdir:
-            ensure_directory_exists(d)
+            if d not in self.written_dirs: # these all exist already
+                ensure_directory_exists(d)
+                self.written_dirs.add(d)
 
         # Walk through the list of revisions
         revisions = list(reversed(page["revisions"])) # order as oldest first
-        prev_size = 0
-        for revision in revisions:
-            is_current = (revision == revisions[-1])
-            is_first = (revision == revisions[0])
-            timestamp = get_timestamp(revision)
-            content = self.pmw2dw_conv.pre_process(revision["*"], page['title'] + "/" + str(timestamp))
-            if content:  # mwlib uparser throws error if no content
-                content = wikicontent.convert_pagecontent(full_title, content)
-            else:
-                print(f"{page['title']} had no content, skipping!")
-            content = self.pmw2dw_conv.post_process(content)
+        if contents is None:
+            contents = self._finish_conversion(page, self._start_conversion(page))
+        # if appending to an existing page's history, no revision is the first one
+        appending = "previous_size" in page
+        prev_size = page.get("previous_size", 0)
+        changes_title = full_title.replace("/", ":")
+        changes = []
+        attic_writes = []
+        attic_files = {}
+        timestamps = [ get_timestamp(revision) for revision in revisions ]
+        last = len(revisions) - 1
+        for i, (revision, content) in enumerate(zip(revisions, contents)):
+            is_first = (i == 0) and not appending
+            timestamp = timestamps[i]
             comment = revision.get("comment", "").replace("\t", " ").split("\n")[0]
-            if is_current:
+            if i == last:
                 comment += " + move from mediawiki to dokuwiki"
-            # path to the .changes metafile
-            changespath = os.path.join(metadir, "%s.changes"%pagename)
-            # for current revision, create 'pages' .txt
-            if is_current:
-                txtpath = os.path.join(pagedir, "%s.txt"%pagename)
-                with codecs.open(txtpath, "w", "utf-8") as f:
-                    f.write(content)
-                os.utime(txtpath, (timestamp,timestamp))
-            # create gzipped attic revision
-            atticname = "%s.%s.txt.gz" % (pagename, timestamp)
-            atticpath = os.path.join(atticdir, atticname).encode("utf-8")
-            with gzip.open(atticpath, "wb") as f:
-                f.write(content.encode("utf-8"))
-            os.utime(atticpath, (timestamp,timestamp))
-            # append entry to page's 'changes' metadata index
-            with codecs.open(changespath, "w" if is_first else "a", "utf-8") as f:
-                changes_title = full_title.replace("/", ":")
-                fields = (str(timestamp), "::1", "C" if is_first else "E", changes_title, names.clean_user(revision["user"]), comment, '', str(revision["size"] - prev_size))
-                print(u"\t".join(fields), file=f)
+            # create gzipped attic revision (revisions made in the same second share one, which ends up with the later revision)
+            if i == last or timestamps[i + 1] != timestamp:
+                atticname = "%s.%s.txt.gz" % (pagename, timestamp)
+                atticpath = os.path.join(atticdir, atticname)
+                self._write_attic(atticpath, content, timestamp, attic_writes, attic_files)
+            # entry for page's 'changes' metadata index
+            fields = (str(timestamp), "::1", "C" if is_first else "E", changes_title, names.clean_user(revision["user"]), comment, '', str(revision["size"] - prev_size))
+            changes.append(u"\t".join(fields) + "\n")
             prev_size = revision["size"]
 
+        # for current revision, create 'pages' .txt
+        txtpath = os.path.join(pagedir, "%s.txt"%pagename)
+        with codecs.open(txtpath, "w", "utf-8") as f:
+            f.write(contents[last])
+        os.utime(txtpath, (timestamps[last],timestamps[last]))
+        # write (or append to) the page's 'changes' metadata index in one go
+        changespath = os.path.join(metadir, "%s.changes"%pagename)
+        with codecs.open(changespath, "a" if appending else "w", "utf-8") as f:
+            f.write(u"".join(changes))
+        if self.changes_log is not None:
+            if not appending:
+                self.changes_log.replace(changes_title)
+            for line in changes:
+                self.changes_log.add(line)
+        self.attic_pending.append((page, attic_writes, attic_files))
+        self._finish_attic_writes(limit=max(1, self.jobs) * 2)
 
-    def _aggregate_changes(self, metadir, aggregate):
+    def _write_attic(self, path, content, timestamp, attic_writes, attic_files):
         """
-        Rebuild the wiki-wide changelong from meta/ to meta/_dokuwiki.changes or
-        from media_meta to media_meta/_media.changes
+        Write the attic revision 'path' (on the attic pool if there is one, adding the Future to
+        'attic_writes'), or hardlink it to an identical attic file written before.
 
-        This is a Pythonified version of https://www.dokuwiki.org/tips:Recreate_Wiki_Change_Log
+        'attic_files' maps the SHA-1 hash of the content of each attic file written for the current
+        page to its (path, Future).
         """
-        lines = []
-        for root, dirs, files in os.walk(metadir):
-            for changesfile in files:
-                if changesfile == aggregate or not changesfile.endswith(".changes"):
-                    continue
-                with codecs.open(os.path.join(root,changesfile), "r", "utf-8") as f:
-                    lines += f.readlines()
-        lines = sorted(lines, key=lambda r: int(r.split("\t")[0]))
-        with codecs.open(os.path.join(metadir, aggregate), "w", "utf-8") as f:
-            f.writelines(lines)
+        digest = None
+        if self.attic_dedup != "none":
+            digest = hashlib.sha1(content.encode("utf-8")).digest()
+            source, source_write = attic_files.get(digest) or self.attic_index.get(digest) or (None, None)
+            if source is not None:
+                self.attic_links += 1
+                if self.attic_pool is not None:
+                    attic_writes.append(self.attic_pool.submit(link_attic, source, path, timestamp, source_write))
+                else:
+                    link_attic(source, path, timestamp)
+                return
+        write = None
+        if self.attic_pool is not None:
+            write = self.attic_pool.submit(write_attic, path, content, timestamp, self.attic_compresslevel)
+            attic_writes.append(write)
+        else:
+            write_attic(path, content, timestamp, self.attic_compresslevel)
+        if digest is not None:
+            attic_files[digest] = (path, write)
+            if self.attic_dedup == "wiki":
+                self.attic_index.setdefault(digest, (path, write))
+
+    def _finish_attic_writes(self, limit=0):
+        """
+        Wait for the attic revisions of the oldest pages written until no more than 'limit' pages
+        are still being compressed, recording each page in the checkpoint once it is complete.
+        """
+        while self.attic_pending:
+            page, attic_writes, attic_files = self.attic_pending[0]
+            if len(self.attic_pending) <= limit and not all(write.done() for write in attic_writes):
+                break
+            self.attic_pending.popleft()
+            for write in attic_writes:
+                write.result()
+            if self.attic_dedup == "wiki":
+                # the writes are done, so only keep the paths
+                for digest, (path, write) in attic_files.items():
+                    if self.attic_index[digest][0] == path:
+                        self.attic_index[digest] = (path, None)
+            if self.checkpoint is not None:
+                self.checkpoint.record_page(page)
+
 
-    def fixup_permissions(self):
+    def fixup_permissions(self, full=False):
         """ Fix permissions under the data directory
 
         This means applying the data directory's permissions and ownership to all underlying parts.
 
+        Only the entries of the directories this exporter wrote to (and of the directories above
+        them) are checked, and only those which differ are changed, unless 'full' is set in which
+        case the whole data directory is walked. Directories are fixed on 'jobs' threads.
+
         If this fails due to insufficient privileges then it just prints a warning and continues on.
         """
         stat = os.stat(self.data)
+        if full:
+            dirs = [ root for root, subdirs, files in os.walk(self.data) ]
+        else:
+            dirs = set([ self.data ])
+            for d in self.written_dirs:
+                # include parents, whose entries may be newly created directories
+                while d not in dirs:
+                    dirs.add(d)
+                    d = os.path.dirname(d)
         try:
-            for root, dirs, files in os.walk(self.data):
-                for name in files:
-                    path = os.path.join(root, name)
-                    os.chmod(path, stat.st_mode & 0o666)
-                    os.chown(path, stat.st_uid, stat.st_gid)
-                for name in dirs:
-                    path = os.path.join(root, name)
-                    os.chmod(path, stat.st_mode)
-                    os.chown(path, stat.st_uid, stat.st_gid)
-
+            with concurrent.futures.ThreadPoolExecutor(max(1, self.jobs)) as executor:
+                list(executor.map(lambda d: fixup_directory(d, stat), sorted(dirs)))
         except OSError:
             print("WARNING: Failed to set permissions under the data directory (not owned by process?) May need to be manually fixed.")
 
@@ -185,6 +488,64 @@ If pre-existing pages exist in Dokuwiki, run the following command (with suffici
   touch "%s"
 """
 
+def convert_revision(converter, title, full_title, text, timestamp):
+    """
+    Convert the mediawiki content 'text' of one revision of page 'title' to dokuwiki content,
+    using the pmw2dw 'converter' for pre- and post-processing around the mwlib conversion.
+
+    The converter can be shared by threads, as long as they were started after
+    wikicontent.allow_deep_parsing() so that they can parse deeply nested pages.
+    """
+    content, context = converter.pre_process(text, title + "/" + str(timestamp))
+    if content:  # mwlib uparser throws error if no content
+        content = wikicontent.convert_pagecontent(full_title, content)
+    else:
+        print(f"{title} had no content, skipping!")
+    return converter.post_process(content, context)
+
+# pmw2dw converter used by each page conversion worker process
+_worker_converter = None
+
+def _init_conversion_worker(file_namespace, file_namespace_aliases, title_index, converter_args):
+    """
+    Set up a page conversion worker process with the same settings as the main process
+    """
+    global _worker_converter
+    wikicontent.dw_file_namespace = file_namespace
+    wikicontent.mw_file_namespace_aliases = file_namespace_aliases
+    wikicontent.title_index = title_index
+    wikicontent.allow_deep_parsing()
+    _worker_converter = pmw2dw_converter(converter_args)
+
+def _convert_revision_in_worker(title, full_title, text, timestamp):
+    return convert_revision(_worker_converter, title, full_title, text, timestamp)
+
+def write_attic(path, content, timestamp, compresslevel=9):
+    """
+    Write the page 'content' of one revision as the gzipped attic file 'path', with the
+    modification time (in the gzip header too) set to the revision's 'timestamp'.
+
+    zlib releases the GIL while compressing, so this can usefully run on several threads.
+    """
+    data = gzip.compress(content.encode("utf-8"), compresslevel, mtime=timestamp)
+    # written alongside and renamed into place, so any other hardlinks to an existing file are left alone
+    partpath = path + ".part"
+    with open(partpath, "wb") as f:
+        f.write(data)
+    os.utime(partpath, (timestamp,timestamp))
+    os.replace(partpath, path)
+
+def link_attic(source, path, timestamp, source_write=None):
+    """
+    Make the attic file 'path' a hardlink to the identical attic file 'source', once the Future
+    'source_write' (if any) has written it. If it has to be copied instead then the copy gets
+    the modification time 'timestamp'. (Dokuwiki only goes by the timestamp in the file name.)
+    """
+    if source_write is not None:
+        source_write.result()
+    if not media.link_or_copy(source, path):
+        os.utime(path, (timestamp,timestamp))
+
 def get_timestamp(node):
     """
     Return a dokuwiki-Compatible Unix int timestamp for a mediawiki API page/image/revision
@@ -192,10 +553,67 @@ def get_timestamp(node):
     dt = simplemediawiki.MediaWiki.parse_date(node['timestamp'])
     return int(calendar.timegm(dt.utctimetuple()))
 
+def fixup_directory(path, stat):
+    """
+    Give each file and subdirectory in the directory 'path' the permissions and ownership
+    of 'stat' (files without the execute bits), skipping those which already have them.
+    """
+    for entry in os.scandir(path):
+        if entry.is_symlink():
+            continue
+        mode = stat.st_mode & (0o7777 if entry.is_dir() else 0o666)
+        current = entry.stat(follow_symlinks=False)
+        if (current.st_mode & 0o7777) != mode:
+            os.chmod(entry.path, mode)
+        if (current.st_uid, current.st_gid) != (stat.st_uid, stat.st_gid):
+            os.chown(entry.path, stat.st_uid, stat.st_gid)
+
 def ensure_directory_exists(path):
     if not os.path.isdir(path):
         os.makedirs(path)
 
+class TitleIndex(object):
+    """
+    Maps the mediawiki titles of the pages (or images, 'kind') being exported to their dokuwiki
+    ids, so each title is only converted once. Titles which aren't in the index, such as link
+    targets, are converted with the memoized make_dokuwiki_pagename.
+
+    Also finds titles which collide, ie map to the same dokuwiki id, so that one would overwrite
+    the other in dokuwiki.
+    """
+    def __init__(self, kind="pages"):
+        self.kind = kind
+        self.ids = {}
+        self.titles = {}
+        self.collisions = {}
+
+    def add(self, title):
+        """ Add the mediawiki 'title' to the index, returning its dokuwiki id """
+        dokuwiki_id = self.ids.get(title)
+        if dokuwiki_id is None:
+            dokuwiki_id = make_dokuwiki_pagename(title)
+            self.ids[title] = dokuwiki_id
+            first = self.titles.setdefault(dokuwiki_id, title)
+            if first != title:
+                self.collisions.setdefault(dokuwiki_id, [ first ]).append(title)
+                print("WARNING: Mediawiki %s '%s' and '%s' both become dokuwiki id '%s', only one of them will be kept" % (self.kind, first, title, dokuwiki_id))
+        return dokuwiki_id
+
+    def add_all(self, titles):
+        for title in titles:
+            self.add(title)
+
+    def get(self, title):
+        """ Return the dokuwiki id of the mediawiki 'title', whether or not it is in the index """
+        dokuwiki_id = self.ids.get(title)
+        return dokuwiki_id if dokuwiki_id is not None else make_dokuwiki_pagename(title)
+
+    def print_collisions(self):
+        if self.collisions:
+            print("%d mediawiki %s were overwritten by others with the same dokuwiki id (see the warnings above.)" %
+                  (sum(len(titles) - 1 for titles in self.collisions.values()), self.kind))
+
+@functools.lru_cache(maxsize=names.NAME_CACHE_SIZE)
 def make_dokuwiki_pagename(mediawiki_name):
     """
     Convert a canonical mediawiki pagename to a dokuwiki pagename
@@ -217,6 +635,7 @@ def make_dokuwiki_pagename(mediawiki_name):
     #result = codecs.encode(result, sys.getfilesystemencoding(), "replace")
     return result
 
+@functools.lru_cache(maxsize=names.NAME_CACHE_SIZE)
 def make_dokuwiki_heading_id(mw_heading_name):
     """
     Convert a Mediawiki internal anchor heading link to the Dokuwiki anchor heading link id
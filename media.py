@@ -0,0 +1,316 @@
+"""
+Concurrent, streaming download of mediawiki images.
+
+Each file is streamed in chunks to a .part file next to its destination and
+then renamed into place once its size and SHA-1 are checked, so large files are
+never held in memory and a half-downloaded file never appears under its final
+name. An interrupted download is resumed from the .part file.
+
+Files can also be copied from a locally mounted mediawiki images directory
+instead of being downloaded.
+
+A MediaIndex records the SHA-1 of each file written, so files which are already
+up to date can be skipped and files with the same content can be hardlinked to
+each other instead of being downloaded again.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, abc, time, json, hashlib, shutil
+import requests
+import workqueue
+
+# bytes read from the connection at a time
+CHUNK_SIZE = 1024 * 1024
+
+class Transfers(abc.ABC):
+    """
+    Base class for copying files into place with up to 'workers' concurrent transfers,
+    subclasses implement transfer().
+    """
+    verb = "Transferred"
+
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self.transferred = 0
+        self.total_bytes = 0
+        self.failures = []
+        self.elapsed = 0.0
+
+    @abc.abstractmethod
+    def transfer(self, source, path, size=None, sha1=None):
+        """ Write the file 'source' to 'path', returning the number of bytes transferred """
+
+    def transfer_all(self, items):
+        """
+        Generator transferring each of 'items', given as (source, path, size, sha1, item) tuples, where
+        'size' and 'sha1' are the expected size and SHA-1 of the file, or None if not known. Yields
+        (item, error) for each in the same order, where error is None if the transfer succeeded
+        or the exception it failed with.
+
+        Only a bounded number of transfers are started ahead of the item being yielded. The
+        statistics are only updated here, as each transfer is yielded, not on the worker threads.
+        """
+        start = time.time()
+        try:
+            transfer_one = lambda entry: self._transfer_one(*entry[:4])
+            for (source, path, size, sha1, item), result in workqueue.map_ordered(transfer_one, items, self.workers):
+                yield item, self._record(source, result)
+        finally:
+            self.elapsed += time.time() - start
+
+    def _transfer_one(self, source, path, size, sha1):
+        """ Return (bytes transferred, None) if transferring 'source' to 'path' succeeds, else (0, the exception) """
+        try:
+            return self.transfer(source, path, size, sha1), None
+        except (requests.RequestException, OSError, RuntimeError) as e:
+            return 0, e
+
+    def _record(self, source, result):
+        """ Add the (bytes transferred, error) 'result' of transferring 'source' to the statistics, returning the error """
+        transferred, error = result
+        if error is not None:
+            self.failures.append((source, error))
+            return error
+        self.transferred += 1
+        self.total_bytes += transferred
+        return None
+
+    def print_summary(self):
+        """ Print the throughput of the transfers so far, and any that failed """
+        megabytes = self.total_bytes / (1024.0 * 1024.0)
+        rate = megabytes / self.elapsed if self.elapsed > 0 else 0.0
+        print("%s %d files (%.1f MB) in %.1fs, %.2f MB/s with %d workers." % (self.verb, self.transferred, megabytes, self.elapsed, rate, self.workers))
+        if self.failures:
+            print("%d files failed, run again with --resume to retry them:" % len(self.failures))
+            for source, error in self.failures:
+                print("  %s" % source)
+
+class Downloader(Transfers):
+    """
+    Downloads files with up to 'workers' concurrent transfers, sharing the connections of
+    the requests 'session' (a new one if None.) 'auth' is passed on with each request.
+
+    A download which fails with a connection error, timeout or server error is retried up to
+    'retries' times, waiting 'backoff' seconds before the first retry and twice as long before
+    each one after that. Retries continue from the end of the partly downloaded file.
+    """
+    verb = "Downloaded"
+
+    def __init__(self, session=None, auth=None, workers=1, timeout=None, retries=0, backoff=1.0):
+        Transfers.__init__(self, workers)
+        self.session = session if session is not None else requests.Session()
+        self.auth = auth
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def download(self, url, path, size=None, sha1=None):
+        """
+        Download 'url' to the file 'path', returning the number of bytes transferred.
+
+        The file is downloaded to 'path'.part, resuming with a Range request from whatever is
+        already there, and only moved to 'path' once its size and SHA-1 hash match the expected
+        'size' and 'sha1' (where given.) If neither is given then a resumed file couldn't be checked,
+        so the download always starts from scratch.
+
+        Raises requests.RequestException (including for HTTP error statuses), OSError, or
+        RuntimeError if the file doesn't match, once out of retries. A partly downloaded file
+        is kept to be resumed later, unless it turned out not to match.
+        """
+        partpath = path + ".part"
+        transferred = 0
+        attempt = 0
+        while True:
+            try:
+                transferred += self._fetch(url, partpath, resume=size is not None or bool(sha1))
+                actual_size = os.path.getsize(partpath)
+                if size is not None and actual_size != size:
+                    raise ContentMismatch("%s is %d bytes, expected %d" % (url, actual_size, size))
+                if sha1 and file_sha1(partpath) != sha1:
+                    raise ContentMismatch("%s doesn't match its SHA-1 hash %s" % (url, sha1))
+                os.replace(partpath, path)
+                return transferred
+            except (requests.RequestException, ContentMismatch) as e:
+                if isinstance(e, ContentMismatch):
+                    os.remove(partpath) # start from scratch next time
+                elif not is_transient(e):
+                    raise
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                attempt += 1
+                print("Retrying %s in %.0fs (%s)" % (url, delay, e))
+                time.sleep(delay)
+
+    def _fetch(self, url, partpath, resume=True):
+        """
+        Download 'url' onto the end of the file 'partpath' (or over it, if 'resume' isn't set),
+        returning the number of bytes transferred
+        """
+        offset = os.path.getsize(partpath) if resume and os.path.exists(partpath) else 0
+        headers = { "Range" : "bytes=%d-" % offset } if offset else {}
+        with self.session.get(url, auth=self.auth, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416 and offset:
+                return 0 # already have the whole file, it gets checked by the caller
+            r.raise_for_status()
+            mode = "ab" if offset and r.status_code == 206 else "wb" # the server may ignore the Range
+            transferred = 0
+            with open(partpath, mode) as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    transferred += len(chunk)
+        return transferred
+
+    transfer = download
+
+class LocalCopier(Transfers):
+    """
+    Copies files from a locally mounted mediawiki images directory, with up to 'workers'
+    concurrent copies. If 'link' is set then files are hardlinked rather than copied where possible.
+
+    If 'owner' is given (the os.stat() of the destination's data directory) then only files which
+    already have its permissions and ownership are linked, so fixing up the permissions of the
+    destination never changes the source files.
+    """
+    verb = "Copied"
+
+    def __init__(self, workers=1, link=False, owner=None):
+        Transfers.__init__(self, workers)
+        self.link = link
+        self.owner = owner
+
+    def transfer(self, source, path, size=None, sha1=None):
+        """
+        Copy (or link) the file 'source' to 'path', returning the number of bytes copied.
+
+        Raises OSError if the file can't be read or written, or RuntimeError if it isn't 'size' bytes.
+        """
+        actual_size = os.path.getsize(source)
+        if size is not None and actual_size != size:
+            raise ContentMismatch("%s is %d bytes, expected %d" % (source, actual_size, size))
+        if self.link and (self.owner is None or has_ownership(source, self.owner)) and link_or_copy(source, path):
+            return 0
+        partpath = path + ".part"
+        copy_file(source, partpath)
+        os.replace(partpath, path)
+        return actual_size
+
+class ContentMismatch(RuntimeError):
+    """ A downloaded file doesn't have the size or SHA-1 hash it was listed with """
+    pass
+
+def is_transient(error):
+    """ Return True if the requests exception 'error' is worth retrying """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and (error.response.status_code >= 500 or error.response.status_code in (408, 429))
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+class MediaIndex(object):
+    """
+    Index of the SHA-1 hash of each image written, stored as JSON in 'path'.
+
+    Each entry also records the size and modification time the file had when it was
+    indexed, so a file which was changed since is hashed again rather than trusted.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self.by_sha1 = {}
+        for filepath, entry in self.entries.items():
+            self.by_sha1.setdefault(entry["sha1"], set()).add(filepath)
+
+    def _current(self, filepath):
+        """ Return the indexed SHA-1 of 'filepath' if the file is unchanged since it was indexed, else None """
+        entry = self.entries.get(filepath)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return None
+        return entry["sha1"]
+
+    def unchanged(self, filepath, sha1):
+        """ Return True if the file 'filepath' exists with the content hashing to 'sha1' """
+        if not sha1 or not os.path.exists(filepath):
+            return False
+        return self._current(filepath) == sha1 or file_sha1(filepath) == sha1
+
+    def find(self, sha1):
+        """ Return the path of an existing file with the content hashing to 'sha1', or None """
+        for filepath in sorted(self.by_sha1.get(sha1, ())):
+            if self._current(filepath) == sha1:
+                return filepath
+        return None
+
+    def record(self, filepath, sha1):
+        """ Record that the file 'filepath' has the content hashing to 'sha1' """
+        old = self.entries.get(filepath)
+        if old is not None:
+            self.by_sha1.get(old["sha1"], set()).discard(filepath)
+        stat = os.stat(filepath)
+        self.entries[filepath] = { "sha1" : sha1, "size" : stat.st_size, "mtime" : stat.st_mtime_ns }
+        self.by_sha1.setdefault(sha1, set()).add(filepath)
+
+    def save(self):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+def file_sha1(path):
+    """ Return the hex SHA-1 hash of the contents of the file 'path' """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def has_ownership(path, stat):
+    """ Return True if the file 'path' has the permissions (without execute bits) and ownership of 'stat' """
+    current = os.stat(path)
+    return (current.st_mode & 0o7777) == (stat.st_mode & 0o666) and (current.st_uid, current.st_gid) == (stat.st_uid, stat.st_gid)
+
+def link_or_copy(source, path):
+    """
+    Make 'path' a hardlink to the file 'source', or a copy of it if the filesystem
+    doesn't support hardlinks. Returns True if a hardlink was made.
+    """
+    partpath = path + ".part"
+    if os.path.exists(partpath):
+        os.remove(partpath)
+    try:
+        os.link(source, partpath)
+        linked = True
+    except OSError:
+        shutil.copyfile(source, partpath)
+        linked = False
+    os.replace(partpath, path)
+    return linked
+
+def copy_file(source, path):
+    """
+    Copy the file 'source' to 'path' inside the kernel, with copy_file_range, or where that
+    isn't supported with shutil.copyfile (which uses sendfile on Linux.)
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source, "rb") as src, open(path, "wb") as dst:
+                while os.copy_file_range(src.fileno(), dst.fileno(), CHUNK_SIZE * 64):
+                    pass
+            return
+        except OSError:
+            pass # not supported between these filesystems, copyfile starts again
+    shutil.copyfile(source, path)
+
+def local_image_path(images_dir, name):
+    """
+    Return the path of the image 'name' under the mediawiki images directory 'images_dir',
+    which uses mediawiki's default hashed layout (images/a/ab/Name.png where 'ab' starts
+    the MD5 hash of the name.)
+    """
+    name = name.replace(" ", "_")
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return os.path.join(images_dir, digest[0], digest[:2], name)
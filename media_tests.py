@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""Tests for downloading, copying and indexing images.
+
+Downloads go to a stub session standing in for the mediawiki server, and the
+index of image hashes is tested on files in a temporary directory.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, hashlib, shutil, tempfile, unittest
+import requests
+import media
+
+DATA = b"0123456789" * 100
+DATA_SHA1 = hashlib.sha1(DATA).hexdigest()
+
+class StubResponse(object):
+    def __init__(self, status_code, body=b""):
+        self.status_code = status_code
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("%d error" % self.status_code, response=self)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+class StubSession(object):
+    """
+    Serves 'data' for every request, honouring Range requests unless 'ranges' is False.
+    'failures' is a list of status codes to answer the first requests with.
+    """
+    def __init__(self, data=DATA, ranges=True, failures=()):
+        self.data = data
+        self.ranges = ranges
+        self.failures = list(failures)
+        self.requests = []
+
+    def get(self, url, auth=None, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers.get("Range"))
+        if self.failures:
+            return StubResponse(self.failures.pop(0))
+        if "Range" in headers and self.ranges:
+            offset = int(headers["Range"].split("=")[1].rstrip("-"))
+            if offset >= len(self.data):
+                return StubResponse(416)
+            return StubResponse(206, self.data[offset:])
+        return StubResponse(200, self.data)
+
+class DownloaderTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "Pic.png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, session, size=len(DATA), sha1=DATA_SHA1, retries=0):
+        return media.Downloader(session, retries=retries, backoff=0).download("http://wiki/Pic.png", self.path, size, sha1)
+
+    def write_part(self, data):
+        with open(self.path + ".part", "wb") as f:
+            f.write(data)
+
+    def assertDownloaded(self, data=DATA):
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+    def test_download(self):
+        session = StubSession()
+        self.assertEqual(self.download(session), len(DATA))
+        self.assertEqual(session.requests, [ None ])
+        self.assertDownloaded()
+
+    def test_resume_partial_content(self):
+        self.write_part(DATA[:300])
+        session = StubSession()
+        self.assertEqual(self.download(session), len(DATA) - 300)
+        self.assertEqual(session.requests, [ "bytes=300-" ])
+        self.assertDownloaded()
+
+    def test_server_ignores_range(self):
+        self.write_part(DATA[:300])
+        session = StubSession(ranges=False)
+        self.assertEqual(self.download(session), len(DATA))
+        self.assertDownloaded()
+
+    def test_already_complete(self):
+        self.write_part(DATA)
+        self.assertEqual(self.download(StubSession()), 0)
+        self.assertDownloaded()
+
+    def test_no_resume_without_checks(self):
+        self.write_part(b"stale")
+        session = StubSession()
+        self.download(session, size=None, sha1=None)
+        self.assertEqual(session.requests, [ None ])
+        self.assertDownloaded()
+
+    def test_retry_server_error(self):
+        session = StubSession(failures=[ 503 ])
+        self.download(session, retries=1)
+        self.assertEqual(len(session.requests), 2)
+        self.assertDownloaded()
+
+    def test_server_error_out_of_retries(self):
+        with self.assertRaises(requests.HTTPError):
+            self.download(StubSession(failures=[ 500, 502 ]), retries=1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_not_found_is_not_retried(self):
+        session = StubSession(failures=[ 404 ])
+        with self.assertRaises(requests.HTTPError):
+            self.download(session, retries=3)
+        self.assertEqual(len(session.requests), 1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_sha1_mismatch(self):
+        self.write_part(b"X" * 300) # stale content, which doesn't match once completed
+        session = StubSession()
+        with self.assertRaises(media.ContentMismatch):
+            self.download(session)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+    def test_sha1_mismatch_retried_from_scratch(self):
+        self.write_part(b"X" * 300)
+        session = StubSession()
+        self.download(session, retries=1)
+        self.assertEqual(session.requests, [ "bytes=300-", None ])
+        self.assertDownloaded()
+
+    def test_transient_errors(self):
+        self.assertTrue(media.is_transient(requests.HTTPError(response=StubResponse(500))))
+        self.assertTrue(media.is_transient(requests.HTTPError(response=StubResponse(429))))
+        self.assertFalse(media.is_transient(requests.HTTPError(response=StubResponse(403))))
+        self.assertTrue(media.is_transient(requests.ConnectionError()))
+        self.assertTrue(media.is_transient(requests.Timeout()))
+
+class MediaIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.tmpdir, "yamdwe.media_index")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_unchanged(self):
+        index = media.MediaIndex(self.index_path)
+        path = self.write("a.png", DATA)
+        self.assertTrue(index.unchanged(path, DATA_SHA1)) # hashed, as it isn't indexed
+        index.record(path, DATA_SHA1)
+        self.assertTrue(index.unchanged(path, DATA_SHA1))
+        self.assertFalse(index.unchanged(path, hashlib.sha1(b"other").hexdigest()))
+        self.assertFalse(index.unchanged(path, None))
+        self.assertFalse(index.unchanged(os.path.join(self.tmpdir, "missing.png"), DATA_SHA1))
+
+    def test_changed_since_indexed(self):
+        index = media.MediaIndex(self.index_path)
+        path = self.write("a.png", DATA)
+        index.record(path, DATA_SHA1)
+        self.write("a.png", b"changed content")
+        self.assertFalse(index.unchanged(path, DATA_SHA1))
+        self.assertIsNone(index.find(DATA_SHA1))
+
+    def test_find(self):
+        index = media.MediaIndex(self.index_path)
+        self.assertIsNone(index.find(DATA_SHA1))
+        path = self.write("a.png", DATA)
+        index.record(path, DATA_SHA1)
+        self.assertEqual(index.find(DATA_SHA1), path)
+        # recording other content for the same file drops it from its old hash
+        self.write("a.png", b"other")
+        index.record(path, hashlib.sha1(b"other").hexdigest())
+        self.assertIsNone(index.find(DATA_SHA1))
+        self.assertEqual(index.find(hashlib.sha1(b"other").hexdigest()), path)
+
+    def test_find_skips_removed_files(self):
+        index = media.MediaIndex(self.index_path)
+        first, second = self.write("a.png", DATA), self.write("b.png", DATA)
+        index.record(first, DATA_SHA1)
+        index.record(second, DATA_SHA1)
+        self.assertEqual(index.find(DATA_SHA1), first)
+        os.remove(first)
+        self.assertEqual(index.find(DATA_SHA1), second)
+
+    def test_save_and_load(self):
+        index = media.MediaIndex(self.index_path)
+        path = self.write("a.png", DATA)
+        index.record(path, DATA_SHA1)
+        index.save()
+        index = media.MediaIndex(self.index_path)
+        self.assertEqual(index.find(DATA_SHA1), path)
+        self.assertTrue(index.unchanged(path, DATA_SHA1))
+
+if __name__ == "__main__":
+    unittest.main()
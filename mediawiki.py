@@ -8,26 +8,39 @@ Licensed under New BSD License as described in the file LICENSE.
 #from __future__ import print_function, unicode_literals, absolute_import, division
 #import simplemediawiki, simplejson
 import simplemediawiki
+import requests
+import http.cookiejar
 import re
 import time
 import json
+import threading
+import collections
+import functools
+import workqueue
 #from pprint import pprint
 
 class Importer(object):
     #def __init__(self, api_url, http_user=None, http_pass="", wiki_user=None, wiki_pass="", wiki_domain=None, verbose=False, delay=0):
-    def __init__(self, api_url, http_user=None, http_pass="", wiki_user=None, wiki_pass="", verbose=False, delay=0):
+    def __init__(self, api_url, http_user=None, http_pass="", wiki_user=None, wiki_pass="", verbose=False, delay=0, batch_size=0, fetch_workers=1,
+                 cookie_file=None, pool_size=10, timeout=None):
         self.verbose = verbose
-        self.delay = delay
+        # queries are limited to one per 'delay' seconds, shared across all fetch workers
+        self.rate_limiter = RateLimiter(1.0 / delay if delay else 0)
+        self.fetch_workers = fetch_workers
         #if wiki_domain:
         #    self.mw = simplemediawiki.MediaWiki(api_url, http_user=http_user, http_password=http_pass, domain=wiki_domain)
         #else:
         #    self.mw = simplemediawiki.MediaWiki(api_url, http_user=http_user, http_password=http_pass)
-        self.mw = simplemediawiki.MediaWiki(api_url, http_user=http_user, http_password=http_pass)
+        self.mw = PooledMediaWiki(api_url, http_user=http_user, http_password=http_pass, cookie_file=cookie_file,
+                                  pool_size=max(pool_size, fetch_workers), timeout=timeout)
+        # the same keep-alive connection pool can be used to download images
+        self.session = self.mw.session
         # login if necessary
         if wiki_user is not None:
             print("Logging in as %s..." % wiki_user)
             if not self.mw.login(wiki_user, wiki_pass):
                 raise RuntimeError("Mediawiki login failed. Wrong credentials?")
+            self.mw.save_cookies()
 
         # version check
         try:
@@ -43,49 +56,177 @@ class Importer(object):
         except IndexError:
             raise RuntimeError("Failed to read Mediawiki siteinfo/generator. Is version older than 1.8? Yamdwe requires 1.13 or greater.")
 
+        # batched fetching, the API accepts up to 50 pageids per query (500 with apihighlimits)
+        self.batch_size = batch_size
+        if batch_size > 1:
+            self.batch_size = min(batch_size, self.mw.limits(50, 500))
+        # number of revisions fetched per query of a single page history
+        self.rvlimit = 'max' if self.batch_size > 1 else '5'
+
     def verbose_print(self, msg):
         if self.verbose:
             print(msg)
 
+    def close(self):
+        """ Save any cookies and close the pooled HTTP connections """
+        self.mw.close()
+
     def get_partial_pages(self, partial_pages):
         return self.get_page_revisions(partial_pages)
 
+    def get_page_list(self):
+        """
+        Get the list of all pages from the mediawiki instance, without any revisions attached.
+        """
+        query = {'list' : 'allpages'}
+        print("Getting list of pages...")
+        return self._query(query, [ 'allpages' ])
+
     def get_all_pages(self):
         """
         Slurp all pages down from the mediawiki instance, together with all revisions including content.
+        Returns a generator, see get_page_revisions().
         WARNING: Hits API hard, don't do this without knowledge/permission of wiki operator!!
         """
-        query = {'list' : 'allpages'}
-        print("Getting list of pages...")
-        pages = self._query(query, [ 'allpages' ])
-        return self.get_page_revisions(pages)
+        return self.get_page_revisions(self.get_page_list())
 
-    def get_page_revisions(self, pages):
+    def get_changed_pages(self, since, namespace=None):
+        """
+        Return the list of pages edited or created since the mediawiki timestamp 'since', according to
+        the wiki's recent changes (optionally only those in 'namespace'.) Each page is listed once.
+        """
+        query = { 'list' : 'recentchanges',
+                  'rcstart' : since,
+                  'rcdir' : 'newer',
+                  'rctype' : 'edit|new',
+                  'rcprop' : 'ids|title|timestamp',
+                  'rclimit' : 'max',
+                  }
+        if namespace is not None:
+            query['rcnamespace'] = namespace
+        print("Getting list of pages changed since %s..." % since)
+        pages = collections.OrderedDict()
+        for change in self._query(query, [ 'recentchanges' ]):
+            if change['pageid'] not in pages:
+                pages[change['pageid']] = { 'pageid' : change['pageid'], 'ns' : change['ns'], 'title' : change['title'] }
+        return list(pages.values())
+
+    def recent_changes_reach(self, since):
+        """
+        Return True if the wiki's recent changes go back as far as the mediawiki timestamp 'since', so
+        get_changed_pages() can list every page changed since then. Mediawiki drops recent changes
+        older than $wgRCMaxAge (90 days by default.)
+        """
+        query = { 'action' : 'query', 'list' : 'recentchanges', 'rcdir' : 'newer', 'rcprop' : 'timestamp', 'rclimit' : 1 }
+        changes = self.mw.call(query)['query']['recentchanges']
+        return bool(changes) and changes[0]['timestamp'] <= since
+
+    def get_server_time(self):
+        """
+        Return the mediawiki server's current time, as a mediawiki timestamp
+        """
+        query = { 'action' : 'query', 'meta' : 'siteinfo', 'siprop' : 'general' }
+        return self.mw.call(query)['query']['general']['time']
+
+    def get_page_revisions(self, pages, since=None):
+        """
+        Generator yielding each page in 'pages' with its revisions attached.
+
+        Revisions are only fetched as each page is consumed, so only one page
+        history needs to be held in memory at a time.
+
+        If the mediawiki timestamp 'since' is given, only revisions made at or after that time are fetched.
+        """
         self.verbose_print("Got %d pages." % len(pages))
         print("Query page revisions (this may take a while)...")
-        for page in pages:
-            self.verbose_print("Querying revisions for pageid %s (%s)..." % (page['pageid'], page['title']))
-            page["revisions"] = self._get_revisions(page)
-            self.verbose_print("Got %d revisions." % len(page["revisions"]))
-        return pages
+        if since is not None:
+            batches = [ [ page ] for page in pages ]
+            fetch = functools.partial(self._get_single_revisions, since=since)
+        elif self.batch_size > 1:
+            batches = [ pages[start:start+self.batch_size] for start in range(0, len(pages), self.batch_size) ]
+            fetch = self._get_batch_revisions
+        else:
+            batches = [ [ page ] for page in pages ]
+            fetch = self._get_single_revisions
+        for batch, result in workqueue.map_ordered(fetch, batches, self.fetch_workers):
+            for page in result:
+                yield page
 
-    def _get_revisions(self, page):
+    def _get_single_revisions(self, batch, since=None):
+        """
+        Return the one page in 'batch' with its revisions attached, as a list.
+        """
+        page = batch[0]
+        self.verbose_print("Querying revisions for pageid %s (%s)..." % (page['pageid'], page['title']))
+        revisions = self._get_revisions(page, end=since)
+        self.verbose_print("Got %d revisions." % len(revisions))
+        return [ dict(page, revisions=revisions) ]
+
+    def _get_revisions(self, page, start_id=None, end=None):
+        """
+        Return the revisions of 'page', newest first, starting at revision 'start_id' and ending
+        at the mediawiki timestamp 'end' if given. A page with no revisions in that range, or which
+        has been deleted, has no revisions.
+        """
         pageid = page['pageid']
         query = { 'prop' : 'revisions',
                   'pageids' : pageid,
                   'rvprop' : 'timestamp|user|comment|content|size',
-                  'rvlimit' : '5',
+                  'rvlimit' : self.rvlimit,
                   }
-        revisions = self._query(query, [ 'pages', str(pageid), 'revisions' ])
+        if start_id is not None:
+            query['rvstartid'] = start_id
+        if end is not None:
+            query['rvend'] = end
+        revisions = []
+        for info in self._iter_query(query, [ 'pages', str(pageid) ], 'revisions'):
+            revisions += info.get('revisions', [])
         return revisions
 
-    def get_all_images(self):
+    def _get_batch_revisions(self, batch):
+        """
+        Return a list of the pages in 'batch' with their revisions attached.
+
+        The API only returns multiple revisions when querying a single page, so the latest
+        revision of every page in the batch is fetched with one multi-page query. Only pages
+        where that revision has a parent then need their older history fetched page by page.
+        """
+        self.verbose_print("Querying latest revisions for %d pages (%s...)" % (len(batch), batch[0]['title']))
+        query = { 'prop' : 'revisions',
+                  'pageids' : "|".join(str(page['pageid']) for page in batch),
+                  'rvprop' : 'ids|timestamp|user|comment|content|size',
+                  }
+        latest = {}
+        for result in self._iter_query(query, [ 'pages' ], 'revisions'):
+            for pageid, info in result.items():
+                if 'revisions' in info:
+                    latest[pageid] = info['revisions']
+        pages = []
+        for page in batch:
+            revisions = latest.get(str(page['pageid']))
+            if revisions is None:
+                print("WARNING: No revisions found for pageid %s (%s), skipping. Was it deleted?" % (page['pageid'], page['title']))
+                continue
+            if revisions[0].get('parentid', 0):
+                self.verbose_print("Querying older revisions for pageid %s (%s)..." % (page['pageid'], page['title']))
+                revisions = revisions + self._get_revisions(page, revisions[0]['parentid'])
+            self.verbose_print("Got %d revisions for %s." % (len(revisions), page['title']))
+            pages.append(dict(page, revisions=revisions))
+        return pages
+
+    def get_all_images(self, since=None):
         """
         Slurp all images down from the mediawiki instance, latest revision of each image, only.
+        Each image has its timestamp, url, size and sha1.
+
+        If the mediawiki timestamp 'since' is given, only images uploaded at or after that time are listed.
 
         WARNING: Hits API hard, don't do this without knowledge/permission of wiki operator!!
         """
-        query = {'list' : 'allimages'}
+        query = {'list' : 'allimages', 'aiprop' : 'timestamp|url|size|sha1'}
+        if since is not None:
+            query['aisort'] = 'timestamp'
+            query['aistart'] = since
         return self._query(query, [ 'allimages' ])
 
     def get_all_users(self):
@@ -100,15 +241,28 @@ class Importer(object):
         Make a Mediawiki API query that results a list of results,
         handle the possibility of making a paginated query using query-continue
         """
+        result = []
+        for inner in self._iter_query(args, path_to_result):
+            result += inner
+        return result
+
+    def _iter_query(self, args, path_to_result, continue_key=None):
+        """
+        Generator behind _query(), yields the result found at 'path_to_result' in each
+        response of a (possibly paginated) query.
+
+        continue_key is the query-continue module to follow, if it isn't the last
+        element of path_to_result.
+        """
         query = { 'action' : 'query' }
         if self.need_rawcontinue:
             query["rawcontinue"] = ""
         query.update(args)
-        result = []
+        if continue_key is None:
+            continue_key = path_to_result[-1]
         continuations = 0
         while True:
-            if self.delay:
-                time.sleep(self.delay)
+            self.rate_limiter.acquire()
             try:
                 response = self.mw.call(query)
             except json.JSONDecodeError as e:
@@ -126,7 +280,7 @@ class Importer(object):
                     inner = inner[key]
             except KeyError:
                 raise RuntimeError("Mediawiki query '%s' returned unexpected response '%s' after %d continuations" % (args, response, continuations))
-            result += inner
+            yield inner
 
             # if there's a warning print it out (shouldn't need a debug flag since this is of interest to any user)
             if 'warnings' in response:
@@ -135,10 +289,10 @@ class Importer(object):
 
             # if there's a continuation, find the new arguments and follow them
             try:
-                query.update(response['query-continue'][path_to_result[-1]])
+                query.update(response['query-continue'][continue_key])
                 continuations += 1
             except KeyError:
-                return result
+                return
 
     def get_file_namespaces(self):
         """
@@ -173,3 +327,80 @@ class Importer(object):
         query = { 'action' : 'query', 'meta' : 'siteinfo', 'siprop' : 'general' }
         result = self.mw.call(query)['query']
         return result['general'].get("mainpage", "Main")
+
+
+class PooledMediaWiki(simplemediawiki.MediaWiki):
+    """
+    simplemediawiki client which sends its API calls through a pooled, keep-alive
+    requests.Session, rather than building a new urllib request (and connection) per call.
+
+    If a cookie_file is given, cookies are only written to it by save_cookies() (after
+    login and at close()), not after every single request.
+    """
+    def __init__(self, api_url, http_user=None, http_password=None, cookie_file=None, pool_size=10, timeout=None):
+        simplemediawiki.MediaWiki.__init__(self, api_url, http_user=http_user, http_password=http_password)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = simplemediawiki.DEFAULT_UA
+        if http_user is not None:
+            self.session.auth = requests.auth.HTTPBasicAuth(http_user, http_password)
+        self.cookie_file = cookie_file
+        if cookie_file is not None:
+            jar = http.cookiejar.LWPCookieJar(cookie_file)
+            try:
+                jar.load(ignore_discard=True)
+            except IOError:
+                pass # no saved cookies yet
+            self.session.cookies = jar
+
+    def _fetch_http(self, url, params, force_get=False):
+        params['format'] = 'json'
+        if force_get:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        else:
+            response = self.session.post(url, data=params, timeout=self.timeout)
+        response.raise_for_status()
+        encoding = None
+        if "charset" in response.headers.get("Content-Type", ""):
+            encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response.content.decode(encoding or "utf-8")
+
+    def save_cookies(self):
+        if self.cookie_file is not None:
+            self.session.cookies.save(ignore_discard=True)
+
+    def close(self):
+        self.save_cookies()
+        self.session.close()
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the rate of API queries, shared between fetch threads.
+
+    'rate' is the number of queries allowed per second (0 means unlimited), 'burst' the
+    number of queries which can be made back to back once the bucket has filled up.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until another query is allowed """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # taking the token may go into debt, which reserves a slot for this caller
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
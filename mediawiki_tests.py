@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Tests for importing pages from the mediawiki API.
+
+The API is replaced by a stub answering queries from a few canned pages,
+so these run without a mediawiki server.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import unittest
+import mediawiki
+
+def revision(revid, timestamp):
+    return { "revid" : revid, "timestamp" : timestamp, "user" : "User", "comment" : "", "*" : "Text %d" % revid, "size" : 7 }
+
+# newest first, as the API returns them
+HISTORY = [ revision(3, "2020-03-03T00:00:00Z"), revision(2, "2020-02-02T00:00:00Z"), revision(1, "2020-01-01T00:00:00Z") ]
+
+class StubMediaWiki(object):
+    """ Answers the queries Importer makes about page 1 (with HISTORY), page 2 (no revisions) and page 3 (deleted) """
+    def __init__(self, recent_changes=()):
+        self.recent_changes = list(recent_changes)
+        self.queries = []
+
+    def call(self, query):
+        self.queries.append(dict(query))
+        if query.get("list") == "recentchanges":
+            changes = [ change for change in self.recent_changes if change["timestamp"] >= query.get("rcstart", "") ]
+            if query.get("rclimit") not in (None, "max"):
+                changes = changes[:int(query["rclimit"])]
+            return { "query" : { "recentchanges" : changes } }
+        pages = {}
+        for pageid in str(query["pageids"]).split("|"):
+            if pageid == "3":
+                pages[pageid] = { "pageid" : 3, "missing" : "" }
+                continue
+            pages[pageid] = { "pageid" : int(pageid), "ns" : 0, "title" : "Page %s" % pageid }
+            revisions = HISTORY if pageid == "1" else []
+            if "rvend" in query:
+                revisions = [ r for r in revisions if r["timestamp"] >= query["rvend"] ]
+            if "rvlimit" not in query:
+                revisions = revisions[:1] # multi-page queries only get the latest revision
+            if revisions:
+                pages[pageid]["revisions"] = [ dict(r) for r in revisions ]
+        return { "query" : { "pages" : pages } }
+
+def stub_importer(mw, batch_size=0):
+    """ An Importer talking to the stub 'mw', skipping the login and version check """
+    importer = mediawiki.Importer.__new__(mediawiki.Importer)
+    importer.verbose = False
+    importer.rate_limiter = mediawiki.RateLimiter(0)
+    importer.fetch_workers = 1
+    importer.mw = mw
+    importer.need_rawcontinue = False
+    importer.batch_size = batch_size
+    importer.rvlimit = "max"
+    return importer
+
+PAGES = [ { "pageid" : pageid, "ns" : 0, "title" : "Page %d" % pageid } for pageid in (1, 2, 3) ]
+
+class RevisionTests(unittest.TestCase):
+    def test_all_revisions(self):
+        pages = list(stub_importer(StubMediaWiki()).get_page_revisions(PAGES))
+        self.assertEqual([ [ r["revid"] for r in page["revisions"] ] for page in pages ], [ [ 3, 2, 1 ], [], [] ])
+
+    def test_revisions_since(self):
+        mw = StubMediaWiki()
+        pages = list(stub_importer(mw).get_page_revisions(PAGES, "2020-02-01T00:00:00Z"))
+        self.assertEqual([ [ r["revid"] for r in page["revisions"] ] for page in pages ], [ [ 3, 2 ], [], [] ])
+        self.assertTrue(all(query["rvend"] == "2020-02-01T00:00:00Z" for query in mw.queries))
+
+    def test_no_new_revisions(self):
+        pages = list(stub_importer(StubMediaWiki()).get_page_revisions(PAGES[:1], "2020-04-01T00:00:00Z"))
+        self.assertEqual(pages, [ dict(PAGES[0], revisions=[]) ])
+
+    def test_batch_skips_deleted_pages(self):
+        pages = stub_importer(StubMediaWiki(), batch_size=50)._get_batch_revisions(PAGES)
+        self.assertEqual([ page["title"] for page in pages ], [ "Page 1" ])
+
+class RecentChangesTests(unittest.TestCase):
+    CHANGES = [ { "type" : "edit", "pageid" : 1, "ns" : 0, "title" : "Page 1", "revid" : 2, "timestamp" : "2020-02-02T00:00:00Z" },
+                { "type" : "edit", "pageid" : 3, "ns" : 0, "title" : "Page 3", "revid" : 5, "timestamp" : "2020-02-03T00:00:00Z" },
+                { "type" : "edit", "pageid" : 1, "ns" : 0, "title" : "Page 1", "revid" : 3, "timestamp" : "2020-03-03T00:00:00Z" } ]
+
+    def test_changed_pages(self):
+        importer = stub_importer(StubMediaWiki(self.CHANGES))
+        self.assertEqual([ page["pageid"] for page in importer.get_changed_pages("2020-02-01T00:00:00Z") ], [ 1, 3 ])
+        self.assertEqual([ page["pageid"] for page in importer.get_changed_pages("2020-03-01T00:00:00Z") ], [ 1 ])
+
+    def test_recent_changes_reach(self):
+        importer = stub_importer(StubMediaWiki(self.CHANGES))
+        self.assertTrue(importer.recent_changes_reach("2020-02-02T00:00:00Z"))
+        self.assertFalse(importer.recent_changes_reach("2020-01-01T00:00:00Z"))
+
+    def test_no_recent_changes(self):
+        self.assertFalse(stub_importer(StubMediaWiki()).recent_changes_reach("2020-01-01T00:00:00Z"))
+
+    def test_changed_then_deleted(self):
+        # a page changed since the last export and then deleted has no revisions left to export
+        importer = stub_importer(StubMediaWiki(self.CHANGES))
+        changed = importer.get_changed_pages("2020-02-01T00:00:00Z")
+        pages = list(importer.get_page_revisions(changed, "2020-02-01T00:00:00Z"))
+        self.assertEqual([ (page["pageid"], len(page["revisions"])) for page in pages ], [ (1, 2), (3, 0) ])
+
+if __name__ == "__main__":
+    unittest.main()
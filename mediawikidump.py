@@ -0,0 +1,135 @@
+"""
+Methods for importing mediawiki pages from an XML dump (as written by dumpBackup.php
+or Special:Export), as an offline alternative to importing via the API.
+
+The dump is parsed incrementally, so memory use is bounded by the largest single
+page history regardless of the size of the dump. Dumps can be compressed with gzip,
+bzip2 or xz.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import gzip, bz2, lzma, urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+class DumpImporter(object):
+    """
+    Imports pages from the XML dump file at 'path'. Only pages in 'namespaces' are
+    imported, by default only the main namespace (the same pages as listed by
+    mediawiki.Importer.get_page_list())
+    """
+    def __init__(self, path, namespaces=(0,)):
+        self.path = path
+        self.namespaces = namespaces
+        self.siteinfo = self._read_siteinfo()
+        print("Reading XML dump of %s (%s)..." % (self.siteinfo.get("sitename", "unknown wiki"),
+                                                  self.siteinfo.get("generator", "unknown version")))
+
+    def _open(self):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "rb")
+        elif self.path.endswith(".bz2"):
+            return bz2.open(self.path, "rb")
+        elif self.path.endswith(".xz"):
+            return lzma.open(self.path, "rb")
+        return open(self.path, "rb")
+
+    def _read_siteinfo(self):
+        """
+        Return a dict of the <siteinfo> header of the dump, with the namespaces as a
+        dict mapping namespace key to name.
+        """
+        siteinfo = { "namespaces" : {} }
+        with self._open() as f:
+            for event, elem in ElementTree.iterparse(f, events=("end",)):
+                tag = local_name(elem.tag)
+                if tag == "namespace":
+                    siteinfo["namespaces"][int(elem.get("key"))] = elem.text or ""
+                elif tag == "siteinfo":
+                    for child in elem:
+                        if local_name(child.tag) != "namespaces":
+                            siteinfo[local_name(child.tag)] = child.text
+                    return siteinfo
+                elif tag == "page":
+                    break # no siteinfo in this dump
+        return siteinfo
+
+    def get_file_namespaces(self):
+        """
+        Return a tuple, same as mediawiki.Importer.get_file_namespaces(). Dumps don't list namespace
+        aliases, so the legacy Image alias is always included.
+        """
+        namespaces = self.siteinfo["namespaces"]
+        file_namespace = namespaces.get(6, "File")
+        aliases = [ "File", "Media", namespaces.get(-2, "Media"), "Image" ]
+        if file_namespace not in aliases:
+            aliases.append(file_namespace)
+        return file_namespace, aliases
+
+    def get_main_pagetitle(self):
+        """
+        Return the title of the main Mediawiki page, found from the dump's base URL
+        """
+        url = urllib.parse.urlparse(self.siteinfo.get("base") or "")
+        title = urllib.parse.parse_qs(url.query).get("title", [ url.path.rsplit("/", 1)[-1] ])[0]
+        return urllib.parse.unquote(title).replace("_", " ") or "Main"
+
+    def get_all_pages(self):
+        """
+        Generator yielding each page in the dump, with all its revisions attached (newest first.)
+
+        Pages and revisions have the same structure as those from mediawiki.Importer.get_all_pages().
+        """
+        with self._open() as f:
+            context = ElementTree.iterparse(f, events=("start", "end"))
+            event, root = next(context)
+            for event, elem in context:
+                if event != "end" or local_name(elem.tag) != "page":
+                    continue
+                page = parse_page(elem)
+                # discard the parsed page, so the tree never holds more than one page
+                root.clear()
+                if page["ns"] in self.namespaces:
+                    yield page
+
+def parse_page(elem):
+    """ Convert a <page> element into a page dict with its revisions attached """
+    page = { "revisions" : [] }
+    for child in elem:
+        tag = local_name(child.tag)
+        if tag == "title":
+            page["title"] = child.text
+        elif tag == "ns":
+            page["ns"] = int(child.text)
+        elif tag == "id":
+            page["pageid"] = int(child.text)
+        elif tag == "revision":
+            page["revisions"].append(parse_revision(child))
+    page["revisions"].reverse() # dumps list oldest first, the API newest first
+    return page
+
+def parse_revision(elem):
+    """ Convert a <revision> element into a revision dict like those returned by the API """
+    revision = { "user" : "", "comment" : "", "*" : "" }
+    for child in elem:
+        tag = local_name(child.tag)
+        if tag == "id":
+            revision["revid"] = int(child.text)
+        elif tag == "timestamp":
+            revision["timestamp"] = child.text
+        elif tag == "contributor":
+            for detail in child:
+                if local_name(detail.tag) in ("username", "ip"):
+                    revision["user"] = detail.text or ""
+        elif tag == "comment":
+            revision["comment"] = child.text or ""
+        elif tag == "text":
+            revision["*"] = child.text or ""
+            if child.get("bytes") is not None:
+                revision["size"] = int(child.get("bytes"))
+    if "size" not in revision:
+        revision["size"] = len(revision["*"].encode("utf-8"))
+    return revision
+
+def local_name(tag):
+    """ Strip the export schema's XML namespace from an element tag """
+    return tag.rsplit("}", 1)[-1]
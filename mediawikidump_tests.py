@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Tests for importing pages from a mediawiki XML dump.
+
+Reads the small dump in test_data/, both plain and gzip compressed, and
+checks the pages and revisions come out as the API would return them.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, unittest
+import mediawikidump
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+class DumpImporterTests(unittest.TestCase):
+    path = os.path.join(TEST_DATA, "dump.xml")
+
+    def setUp(self):
+        self.dump = mediawikidump.DumpImporter(self.path)
+
+    def test_siteinfo(self):
+        self.assertEqual(self.dump.siteinfo["sitename"], "Testiwiki")
+        self.assertEqual(self.dump.siteinfo["namespaces"][1], "Keskustelu")
+        self.assertEqual(self.dump.get_main_pagetitle(), "Etusivu")
+
+    def test_file_namespaces(self):
+        file_namespace, aliases = self.dump.get_file_namespaces()
+        self.assertEqual(file_namespace, "Tiedosto")
+        for alias in ("File", "Image", "Media", "Tiedosto"):
+            self.assertIn(alias, aliases)
+
+    def test_main_namespace_only(self):
+        pages = list(self.dump.get_all_pages())
+        self.assertEqual([ (page["pageid"], page["title"], page["ns"]) for page in pages ], [ (1, "Etusivu", 0), (3, "Ilman versioita", 0) ])
+
+    def test_other_namespaces(self):
+        dump = mediawikidump.DumpImporter(self.path, namespaces=(0, 1))
+        self.assertEqual([ page["title"] for page in dump.get_all_pages() ], [ "Etusivu", "Keskustelu:Etusivu", "Ilman versioita" ])
+
+    def test_revisions(self):
+        page = next(self.dump.get_all_pages())
+        # newest first, like the API
+        self.assertEqual([ revision["revid"] for revision in page["revisions"] ], [ 12, 11, 10 ])
+        blanked, edited, first = page["revisions"]
+        self.assertEqual(first, { "revid" : 10, "timestamp" : "2020-01-01T10:00:00Z", "user" : "Ensimmäinen",
+                                  "comment" : "First version", "*" : "== Tervetuloa ==\nHei", "size" : 20 })
+        # an IP contributor, and no comment or size given
+        self.assertEqual(edited["user"], "192.0.2.1")
+        self.assertEqual(edited["comment"], "")
+        self.assertEqual(edited["size"], len("== Tervetuloa ==\nHei ''maailma''"))
+        # a deleted contributor and empty text
+        self.assertEqual((blanked["user"], blanked["*"], blanked["size"]), ("", "", 0))
+
+    def test_page_without_revisions(self):
+        pages = list(self.dump.get_all_pages())
+        self.assertEqual(pages[-1]["revisions"], [])
+
+class GzipDumpImporterTests(DumpImporterTests):
+    path = os.path.join(TEST_DATA, "dump.xml.gz")
+
+    def test_same_as_plain(self):
+        plain = mediawikidump.DumpImporter(DumpImporterTests.path, namespaces=(0, 1))
+        compressed = mediawikidump.DumpImporter(self.path, namespaces=(0, 1))
+        self.assertEqual(list(compressed.get_all_pages()), list(plain.get_all_pages()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,12 +4,18 @@ Simple name munging functions used by both yamdwe.py and yamdwe_users.py
 Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
-import re, os.path, unicodedata
+import re, os.path, unicodedata, functools
 
+# number of names remembered by each of the memoized name functions
+NAME_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
 def clean_id(name, preserve_case=False):
     """
     Return a 'clean' dokuwiki-compliant name. Based on the cleanID() PHP function in inc/pageutils.php
 
+    Memoized, as the same names (users, link targets) come up again and again.
+
     Ignores both slashes and colons as valid namespace choices (to convert slashes to colons,
     call make_dokuwiki_pagename)
     """
@@ -21,33 +21,46 @@ class pmw2dw_args():
 	tables_start_marker: str = '<__pmw2dw_table>'
 	tables_end_marker: str = '</__pmw2dw_table>'
 
-# Main class to actually do all the substitutions & stuff
+# The state of converting one document, returned by pre_process to pass on to post_process
+class pmw2dw_context():
+	def __init__(self, identifier: str):
+		# Identifies the document in warnings
+		self.case_id: str = identifier
+		# The mediawiki-formatted tables taken out of it
+		self.table_contents: list[str] = []
+
+# Main class to actually do all the substitutions & stuff.
+# It holds no per-document state, so one converter can be shared by several threads.
 class pmw2dw_converter():
 	def __init__(self, args: pmw2dw_args):
 		# For replacing template contents
 		self.template_replacements: dict[str, str] | None = None
+		self.templates_in_one_pass: bool = False
+		self.longest_template: int = 0
 		if args.template_replacements_filename:
 			with open(args.template_replacements_filename, mode='r', encoding="utf-8") as f:
-				self.template_replacements = json.load(f)
-		# For keeping mediawiki-formtted tables
-		self.table_contents: list[str] | None = None
+				self.set_template_replacements(json.load(f))
 		# For fixing ArticleLinks into ImageLinks or CategoryLinks
-		self.link_maps: list[tuple[re.Pattern, str]] = []
+		# (a link can only match if its prefix is in the text, unless the link type is a regex itself)
+		self.link_maps: list[tuple[str | None, re.Pattern, object]] = []
 		for in_txt, out_txt in args.link_mappings.items():
 			regex_pattern: re.Pattern = re.compile(r"\[\[" + in_txt + r":(.+)\]\]")
-			replacement: str = "[[" + out_txt + ":" + r"\1" + "]]"
-			self.link_maps.append( (regex_pattern, replacement) )
+			prefix: str | None = "[[" + in_txt + ":" if re.escape(in_txt) == in_txt else None
+			self.link_maps.append( (prefix, regex_pattern, group_replacer("[[" + out_txt + ":", "]]")) )
+		# Style replacements within tables
+		self.table_style_maps: list[tuple[re.Pattern, object]] = []
+		for old_style, new_style in args.in_table_style_replacements:
+			self.table_style_maps.append( (re.compile(old_style + '(.+)' + old_style), group_replacer(new_style, new_style)) )
+		self.tables_regex: re.Pattern = re.compile(args.tables_start_marker + '([0-9]+)' + args.tables_end_marker)
 		# For use of our methods
-		self.case_id: str = ""
 		self.args: pmw2dw_args = args
 
 	# Separate tables from mediawiki string
-	def separate_tables(self, content: str) -> str:
+	def separate_tables(self, content: str, context: pmw2dw_context) -> str:
 		if not self.args.keep_tables:
 			return content
-		slice_locs = find_nested_blocks('{|', '|}', content, self.case_id)
+		slice_locs = find_nested_blocks('{|', '|}', content, context.case_id)
 		not_tables: list[str] = []
-		self.table_contents = []
 		prev_end: int = 0
 		for counter, splits in enumerate(slice_locs):
 			start: int = splits[0]
@@ -56,39 +69,83 @@ class pmw2dw_converter():
 			not_tables.append(self.args.tables_start_marker + str(counter) + self.args.tables_end_marker)
 			prev_end = end
 			table: str = content[start:end]
-			for repl in self.args.in_table_style_replacements:
-				pattern = repl[0] + '(.+)' + repl[0]
-				replacement = repl[1] + r'\1' + repl[1]
-				table = re.sub(pattern, replacement, table)
+			for regex_pattern, replacement in self.table_style_maps:
+				table = regex_pattern.sub(replacement, table)
 			# Tables may also contain templates
 			table = self.replace_templates(table)
-			self.table_contents.append(table)
+			context.table_contents.append(table)
 		not_tables.append(content[prev_end:])
 		return "".join(not_tables)
 
 	# Join mediawiki tables back in to dokuwiki string
-	def join_tables_back_in(self, content: str) -> str:
+	def join_tables_back_in(self, content: str, context: pmw2dw_context) -> str:
 		if not self.args.keep_tables:
 			return content
-		regex = self.args.tables_start_marker + '([0-9]+)' + self.args.tables_end_marker
 		def get_table(matchobj):
-			return self.table_contents[int(matchobj.group(1))]
-		return re.sub(regex, get_table, content)
+			return context.table_contents[int(matchobj.group(1))]
+		return self.tables_regex.sub(get_table, content)
 
 	# Replacing locally translated link types to en versions
 	def replace_links(self, content: str) -> str:
-		for regex_pattern, replacement in self.link_maps:
-			content = regex_pattern.sub(replacement, content)
+		for prefix, regex_pattern, replacement in self.link_maps:
+			if prefix is None or prefix in content:
+				content = regex_pattern.sub(replacement, content)
 		return content
 
+	# Use the 'replacements' of templates. If every template replaced is a plain {{...}} one,
+	# then occurrences of them can't overlap and they can all be replaced in one pass, as long
+	# as replacing one can't make another (their replacements are plain templates which aren't
+	# replaced themselves, or have no braces at all so only nested templates need checking. Even
+	# a single brace could join up with the text around it into another template.)
+	# With only a few templates, a str.replace for each is quicker.
+	def set_template_replacements(self, replacements: dict[str, str]):
+		self.template_replacements = replacements
+		self.templates_in_one_pass = len(replacements) >= 16 and all(
+			is_plain_template(old_templ) and (
+				(is_plain_template(new_file) and new_file not in replacements) or
+				('{' not in new_file and '}' not in new_file))
+			for old_templ, new_file in replacements.items())
+		self.longest_template = max(map(len, replacements), default=0)
+
 	# Replace templates with what should be acceptable dokuwiki files
 	def replace_templates(self, content: str) -> str:
 		if '{{' not in content or not self.template_replacements:
 			return content
+		if self.templates_in_one_pass:
+			replaced = self.replace_templates_in_one_pass(content)
+			if replaced is not None:
+				return replaced
 		for old_templ, new_file in self.template_replacements.items():
 			content = content.replace(old_templ, new_file)
 		return content
 
+	# Replace all the templates in one pass, looking each {{...}} up in template_replacements.
+	# Returns None if a template being replaced is nested in another one, as replacing
+	# them one by one could then give a different result.
+	def replace_templates_in_one_pass(self, content: str) -> str | None:
+		parts: list[str] = []
+		prev_end: int = 0
+		unknown_end: int = -1
+		start: int = content.find('{{')
+		while start != -1:
+			end: int = content.find('}}', start + 2) + 2
+			new_file: str | None = None
+			if end > 1 and end - start <= self.longest_template:
+				new_file = self.template_replacements.get(content[start:end])
+			if new_file is None:
+				# a template (or stray {{) which isn't replaced, maybe with one to replace inside it
+				unknown_end = end
+				start = content.find('{{', start + 1)
+				continue
+			if end == unknown_end:
+				return None
+			parts.append(content[prev_end:start])
+			parts.append(new_file)
+			prev_end = end
+			start = content.find('{{', end)
+		parts.append(content[prev_end:])
+		return "".join(parts)
+
 	# Replace any other html stuff
 	def replace_other_html(self, content: str) -> str:
 		for old_templ, new_file in self.args.other_html_replacements:
@@ -96,21 +153,36 @@ class pmw2dw_converter():
 		return content
 
 	# The order here matters, as separating tables removes them from
-	# the string that will be parsed and converted to dokuwiki markup
-	def pre_process(self, content: str, identifier: str) -> str:
-		self.case_id = identifier
-		content = self.separate_tables(content)
+	# the string that will be parsed and converted to dokuwiki markup.
+	# Returns the content along with the context to pass to post_process.
+	def pre_process(self, content: str, identifier: str) -> tuple[str, pmw2dw_context]:
+		context = pmw2dw_context(identifier)
+		content = self.separate_tables(content, context)
 		content = self.replace_templates(content)
 		content = self.replace_links(content)
-		return content
+		return content, context
 
-	def post_process(self, content: str) -> str:
-		content = self.join_tables_back_in(content)
+	def post_process(self, content: str, context: pmw2dw_context) -> str:
+		content = self.join_tables_back_in(content, context)
 		content = self.replace_other_html(content)
-		self.case_id = ""
 		return content
 
 
+# Is 'text' a template, starting with {{ and ending with }} with neither in between
+def is_plain_template(text: str) -> bool:
+	return text.startswith('{{') and text.endswith('}}') and '{{' not in text[1:] and '}}' not in text[:-1]
+
+
+# Makes a regex replacement function equivalent to the template 'before\1after',
+# which is quicker than a template string (expanded in Python for every match)
+def group_replacer(before: str, after: str):
+	if "\\" in before + after:
+		return before + r"\1" + after  # has escapes of its own
+	def replace(matchobj):
+		return before + matchobj.group(1) + after
+	return replace
+
+
 # A function to find top-level blocks from text,
 # with possible inner nested blocks left within the top-level ones.
 def find_nested_blocks(start: str, end: str, text: str, identifier: str) -> list[int]:
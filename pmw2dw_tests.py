@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Tests for the pmw2dw pre- and post-processing of mediawiki content.
+
+Checks that replacing templates in one pass gives the same result as
+replacing each template in turn with str.replace, both for known tricky
+cases and for every short combination of templates and braces.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import itertools, unittest
+from pmw2dw import pmw2dw_args, pmw2dw_converter
+
+class test_args(pmw2dw_args):
+	template_replacements_filename: str | None = None
+
+# Enough templates that replace_templates takes the one-pass path
+FILLER = { "{{Filler %d}}" % i : "{{filler_%d.png}}" % i for i in range(20) }
+
+# Replace each template in turn, as replace_templates always used to
+def replace_each(replacements: dict[str, str], content: str) -> str:
+	for old_templ, new_file in replacements.items():
+		content = content.replace(old_templ, new_file)
+	return content
+
+class TemplateReplacementTests(unittest.TestCase):
+	def check(self, replacements: dict[str, str], content: str):
+		converter = pmw2dw_converter(test_args)
+		converter.set_template_replacements(replacements)
+		self.assertEqual(converter.replace_templates(content), replace_each(replacements, content),
+			"replacing %r in %r" % (replacements, content))
+
+	def test_one_pass_is_used(self):
+		converter = pmw2dw_converter(test_args)
+		converter.set_template_replacements(dict(FILLER, **{ "{{Foo}}" : "{{foo.png}}", "{{Bar}}" : "bar" }))
+		self.assertTrue(converter.templates_in_one_pass)
+		self.assertEqual(converter.replace_templates("a {{Foo}} b {{Bar}} {{Baz}} {{Filler 3}}"), "a {{foo.png}} b bar {{Baz}} {{filler_3.png}}")
+
+	def test_few_templates(self):
+		self.check({ "{{Foo}}" : "{{foo.png}}" }, "a {{Foo}} b")
+
+	def test_single_brace_replacement(self):
+		# replacing {{A}} makes {{B}}, which is then replaced in turn
+		self.check(dict(FILLER, **{ "{{A}}" : "{", "{{B}}" : "Z" }), "{{A}}{B}}")
+		self.check(dict(FILLER, **{ "{{A}}" : "}", "{{B}}" : "Z" }), "{{B{{A}}}")
+
+	def test_replacement_is_replaced(self):
+		self.check(dict(FILLER, **{ "{{A}}" : "{{B}}", "{{B}}" : "Z" }), "{{A}} {{B}}")
+
+	def test_nested_templates(self):
+		self.check(dict(FILLER, **{ "{{A}}" : "x", "{{Bx}}" : "Z" }), "{{B{{A}}}}")
+		self.check(dict(FILLER, **{ "{{A}}" : "x", "{{xB}}" : "Z" }), "{{{{A}}B}}")
+		self.check(dict(FILLER, **{ "{{A}}" : "{{a.png}}" }), "{{Unknown|{{A}}}}")
+
+	# Every short sequence of template and brace pieces, with every combination of a few kinds of replacement
+	def test_all_small_cases(self):
+		pieces = [ "{{A}}", "{{B}}", "{{", "}}", "{", "}", "A", "B" ]
+		contents = sorted(set("".join(sequence) for length in range(5) for sequence in itertools.product(pieces, repeat=length)))
+		values = [ "", "x", "{", "}", "{x", "x}", "{{A}}", "{{B}}", "{{c.png}}" ]
+		converter = pmw2dw_converter(test_args)
+		for first, second in (("{{A}}", "{{B}}"), ("{{B}}", "{{A}}")):
+			for first_value, second_value in itertools.product(values, repeat=2):
+				replacements = dict(FILLER, **{ first : first_value, second : second_value })
+				converter.set_template_replacements(replacements)
+				for content in contents:
+					self.assertEqual(converter.replace_templates(content), replace_each(replacements, content),
+						"replacing %r in %r" % (replacements, content))
+
+if __name__ == "__main__":
+	unittest.main()
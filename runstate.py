@@ -0,0 +1,103 @@
+"""
+State kept between runs of yamdwe, so an interrupted export can be resumed.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, json
+
+class Checkpoint(object):
+    """
+    Journal of export progress, written to 'path' as one JSON entry per line and
+    flushed after each entry so it survives the process being killed.
+
+    It records each page once all its revisions have been written, each image once it
+    has been written, and each phase of the export (pages, images) once it is complete
+    including its wiki-wide changes log. It also records the mediawiki server time the
+    export started at, so a resumed export still syncs from when the first run started.
+
+    If 'resume' is set then the entries of an existing journal are loaded and appended
+    to, otherwise the journal is started afresh.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.pages = {}
+        self.images = set()
+        self.phases = set()
+        self.sync_start = None
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # partly written entry from a killed process
+                    if "page" in entry:
+                        self.pages[entry["page"]] = entry
+                    elif "image" in entry:
+                        self.images.add(entry["image"])
+                    elif "phase" in entry:
+                        self.phases.add(entry["phase"])
+                    elif "sync_start" in entry:
+                        self.sync_start = entry["sync_start"]
+        # pages and images already exported by an earlier run, whose changes this run never sees
+        self.resumed_pages = bool(self.pages)
+        self.resumed_images = bool(self.images)
+        self.journal = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _write(self, entry):
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+
+    def page_done(self, page):
+        return page_key(page) in self.pages
+
+    def record_page(self, page):
+        revisions = page.get("revisions", [])
+        entry = { "page" : page_key(page), "title" : page["title"], "revisions" : len(revisions),
+                  "timestamp" : revisions[0]["timestamp"] if revisions else None }
+        self.pages[entry["page"]] = entry
+        self._write(entry)
+
+    def image_done(self, image):
+        return image["name"] in self.images
+
+    def record_image(self, image):
+        self.images.add(image["name"])
+        self._write({ "image" : image["name"] })
+
+    def phase_done(self, phase):
+        return phase in self.phases
+
+    def record_phase(self, phase):
+        self.phases.add(phase)
+        self._write({ "phase" : phase })
+
+    def record_sync_start(self, timestamp):
+        self.sync_start = timestamp
+        self._write({ "sync_start" : timestamp })
+
+    def close(self):
+        self.journal.close()
+
+def page_key(page):
+    """ Pages are identified by pageid, or by title if a (partial pages) entry has no pageid """
+    return page.get("pageid", page["title"])
+
+class SyncState(object):
+    """
+    The mediawiki server time at which the last complete export started, stored in 'path'.
+
+    An incremental export fetches only what changed since then.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.timestamp = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.timestamp = json.load(f)["timestamp"]
+
+    def save(self, timestamp):
+        self.timestamp = timestamp
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({ "timestamp" : timestamp }, f)
+        os.replace(self.path + ".tmp", self.path)
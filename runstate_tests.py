@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Tests for the state yamdwe keeps between runs to resume an interrupted export.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import os, shutil, tempfile, unittest
+import runstate
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "yamdwe.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def interrupted_export(self):
+        checkpoint = runstate.Checkpoint(self.path)
+        checkpoint.record_sync_start("2020-03-01T00:00:00Z")
+        checkpoint.record_page({ "pageid" : 1, "title" : "One", "revisions" : [ { "timestamp" : "2020-01-02T00:00:00Z" } ] })
+        checkpoint.record_page({ "title" : "Partial" })
+        checkpoint.record_phase("pages")
+        checkpoint.record_image({ "name" : "Pic.png" })
+        checkpoint.close()
+
+    def test_resume(self):
+        self.interrupted_export()
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        self.assertTrue(checkpoint.page_done({ "pageid" : 1, "title" : "Renamed" }))
+        self.assertTrue(checkpoint.page_done({ "title" : "Partial" }))
+        self.assertFalse(checkpoint.page_done({ "pageid" : 2, "title" : "Two" }))
+        self.assertTrue(checkpoint.image_done({ "name" : "Pic.png" }))
+        self.assertFalse(checkpoint.image_done({ "name" : "Other.png" }))
+        self.assertTrue(checkpoint.phase_done("pages"))
+        self.assertFalse(checkpoint.phase_done("images"))
+        self.assertEqual(checkpoint.sync_start, "2020-03-01T00:00:00Z")
+        self.assertTrue(checkpoint.resumed_pages)
+        self.assertTrue(checkpoint.resumed_images)
+        checkpoint.close()
+
+    def test_resume_appends(self):
+        self.interrupted_export()
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        checkpoint.record_phase("images")
+        checkpoint.close()
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        self.assertTrue(checkpoint.phase_done("pages"))
+        self.assertTrue(checkpoint.phase_done("images"))
+        checkpoint.close()
+
+    def test_without_resume_starts_afresh(self):
+        self.interrupted_export()
+        checkpoint = runstate.Checkpoint(self.path)
+        self.assertFalse(checkpoint.page_done({ "pageid" : 1, "title" : "One" }))
+        self.assertIsNone(checkpoint.sync_start)
+        checkpoint.close()
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        self.assertFalse(checkpoint.phase_done("pages"))
+        self.assertFalse(checkpoint.resumed_pages)
+        checkpoint.close()
+
+    def test_partly_written_entry(self):
+        self.interrupted_export()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"page": 2, "tit')
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        self.assertTrue(checkpoint.page_done({ "pageid" : 1, "title" : "One" }))
+        self.assertFalse(checkpoint.page_done({ "pageid" : 2, "title" : "Two" }))
+        checkpoint.close()
+
+    def test_resume_without_journal(self):
+        checkpoint = runstate.Checkpoint(self.path, resume=True)
+        self.assertFalse(checkpoint.resumed_pages)
+        self.assertIsNone(checkpoint.sync_start)
+        checkpoint.close()
+        self.assertTrue(os.path.exists(self.path))
+
+class SyncStateTests(unittest.TestCase):
+    def test_save_and_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "yamdwe.sync")
+            self.assertIsNone(runstate.SyncState(path).timestamp)
+            runstate.SyncState(path).save("2020-03-01T00:00:00Z")
+            self.assertEqual(runstate.SyncState(path).timestamp, "2020-03-01T00:00:00Z")
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    unittest.main()
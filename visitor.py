@@ -115,74 +115,72 @@ class method_overload(object):
     name on a particular class (or no class.) These are internal,
     created at module import time.
 
+    The chain of functions to call for each argument type is worked out
+    the first time that type is seen, and cached until another overload is registered.
+
     """
     def __init__(self, func_name):
         self.func_name = func_name
         self.registry = {}
         self.allow_cascade = {}
+        self.chains = {}
 
     def register(self, argtype, func, allow_cascade):
         self.registry[argtype] = func
         self.allow_cascade[argtype] = allow_cascade
+        self.chains = {}
+
+    def chain(self, argtype):
+        """ Return a tuple of the overloads to call (in order) for a first argument of type argtype
+        """
+        try:
+            return self.chains[argtype]
+        except KeyError:
+            pass
+        hier = list(inspect.getmro(argtype)) # class hierarchy
+        hier.reverse() # order w/ superclass first
+        hier = [ t for t in hier if t in self.registry ]
+        if len(hier) == 0:
+            raise TypeError("Function %s has no compatible overloads registered for argument type %s" %
+                            (self.func_name, argtype))
+        # don't "cascade" down from superclasses which don't allow it
+        chain = tuple(self.registry[t] for t in hier if self.allow_cascade[t] or t == hier[-1])
+        self.chains[argtype] = chain
+        return chain
 
     def __get__(self, obj, type=None):
         """ This __get__ is called when the method is bound on a
-        class, and returns a bound_caller which knows the instance and
-        the class type.
+        class, and returns a method which calls the overloads with the instance.
 
         If the method is not bound on a class, this is skipped and
         __call__ is called directly.
 
         """
-        return bound_caller(self, obj, type)
+        if obj is None:
+            return self
+        return types.MethodType(self.call_bound, obj)
 
     def __call__(self, *args, **kw):
-        """ This __call__ is only reached when the method is not bound to a class 
+        """ This __call__ is only reached when the method is not bound to a class
         """
-        return self.call_internal(lambda f:f, args, kw)
+        chain = self.chain(type(args[0]))
+        if len(chain) == 1:
+            return chain[0](*args, **kw)
+        result = None
+        for func in chain:
+            result = func(*args, **kw)
+        return result
 
-    def call_internal(self, func_modifier, args, kw):
-        """ Common utility class for calling an overloaded method,
-        either bound on a class or not.  func_modifier is a lambda
-        function which is used to "bind" bound methods to the correct
-        instance
+    def call_bound(self, obj, *args, **kw):
+        """ Call the overloads for a method bound to the instance obj
         """
-        argtype = type(args[0])
-        class Old:
-            pass
-        #if argtype is types.InstanceType: # old-style class
-        #    argtype = args[0].__class__
-        hier = list(inspect.getmro(argtype)) # class hierarchy
-        hier.reverse() # order w/ superclass first
-        hier = [ t for t in hier if t in self.registry ]
-        if len(hier) == 0:
-            raise TypeError("Function %s has no compatible overloads registered for argument type %s" % 
-                            (self.func_name, argtype))            
+        chain = self.chain(type(args[0]))
+        if len(chain) == 1:
+            return chain[0](obj, *args, **kw)
         result = None
-        for t in hier:
-            if not self.allow_cascade[t] and t != hier[-1]:
-                continue # don't "cascade" down from superclass on this method
-            result = func_modifier(self.registry[t])(*args, **kw)
+        for func in chain:
+            result = func(obj, *args, **kw)
         return result
-        
-
-class bound_caller(object):
-    """ Temporary class instantiated once per method call(!!) for
-    methods bound to a class, contains the bound instance and its
-    class type.
-
-    (Implementation note: It may be possible to replace this with a nested function or a
-    lambda function, not sure if this would change overhead?)
-
-    """
-    def __init__(self, overload, obj, cls):
-        self.overload = overload
-        self.obj = obj
-        self.cls = cls
-        
-    def __call__(self, *args, **kw):        
-        return self.overload.call_internal(lambda l:l.__get__(self.obj, self.cls), args, kw)
-
 
 
 def is_visitor(cls):
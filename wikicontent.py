@@ -7,7 +7,7 @@ Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
 #from __future__ import print_function, unicode_literals, absolute_import, division
-import re, string, dokuwiki, visitor
+import re, string, sys, types, threading, dokuwiki, visitor
 from mwlib.parser import *
 from mwlib import parser, refine
 from mwlib.refine import uparser
@@ -15,6 +15,13 @@ from mwlib.refine import uparser
 # Regex to match any known File: namespace (can be updated based on the mediawiki installation language)
 mw_file_namespace_aliases = re.compile("^(Image|File):", re.IGNORECASE)
 dw_file_namespace = "File:"
+# dokuwiki.TitleIndex of the pages being exported, if any
+title_index = None
+
+# recursion limit for mwlib to parse a page, enough for pages nested thousands of levels deep
+PARSER_RECURSION_LIMIT = 20000
+# stack size of threads started once parsing is allowed that deep, so any thread can parse
+PARSER_THREAD_STACK_SIZE = 64 * 1024 * 1024
 
 def set_file_namespaces(canonical_alias, aliases):
     """
@@ -62,8 +69,7 @@ def convert_pagecontent(title, content):
         return "<__yamdwe_nowiki>%d</__yamdwe_nowiki>" % (len(nowiki_plaintext)-1,)
     content = re.sub(r"<nowiki>.+?</nowiki>", add_nowiki_block, content)
 
-    #root = uparser.parseString(title, content) # create parse tree
-    root = uparser.parse_string(title, content) # create parse tree
+    root = parse(title, content) # create parse tree
     context = {}
     context["list_stack"] = []
     context["nowiki_plaintext"] = nowiki_plaintext # hacky way of attaching to child nodes
@@ -74,34 +80,88 @@ def convert_pagecontent(title, content):
         result = "~~NOTOC~~"+("\n" if not result.startswith("\n") else "")+result
     return result
 
+def allow_deep_parsing():
+    """
+    Raise the (process-wide) recursion limit to PARSER_RECURSION_LIMIT for mwlib's parser, and
+    give threads started from now on a stack big enough to parse on them too.
+
+    Call this once at startup, before starting any threads. The limit is never lowered again,
+    as lowering it would break a parse running on another thread at the time.
+    """
+    if sys.getrecursionlimit() < PARSER_RECURSION_LIMIT:
+        sys.setrecursionlimit(PARSER_RECURSION_LIMIT)
+    if threading.stack_size() < PARSER_THREAD_STACK_SIZE:
+        threading.stack_size(PARSER_THREAD_STACK_SIZE)
+
+def parse(title, content):
+    """
+    Return the mwlib parse tree of Mediawiki 'content'.
+
+    mwlib's parser recurses once per level of nesting in the page, so this needs
+    allow_deep_parsing() (which is done here if it hasn't been already, but only helps
+    threads started after it.) The conversion itself doesn't recurse.
+    """
+    if sys.getrecursionlimit() < PARSER_RECURSION_LIMIT:
+        allow_deep_parsing()
+    return uparser.parse_string(title, content)
+
+def convert(node, context, trailing_newline):
+    """
+    Convert the parse tree 'node' to a string of Dokuwiki content.
+
+    The tree is walked with an explicit stack rather than by recursion, so deeply
+    nested pages don't need a deep Python (or C) stack. Handlers which need to convert
+    child nodes are generators: they yield (child, trailing_newline) and are sent
+    back the child's converted content. Handlers for leaf nodes just return a string.
+    """
+    result = convert_node(node, context, trailing_newline)
+    if not isinstance(result, types.GeneratorType):
+        return result
+    stack = [ result ]
+    value = None
+    while stack:
+        try:
+            child, trailing_newline = stack[-1].send(value)
+        except StopIteration as done:
+            stack.pop()
+            value = done.value
+            continue
+        value = convert_node(child, context, trailing_newline)
+        if isinstance(value, types.GeneratorType):
+            stack.append(value)
+            value = None
+    return value
+
 def convert_children(node, context):
-    """Walk the children of this parse node and call convert() on each.
+    """Walk the children of this parse node and convert each, a generator for use
+    with 'yield from' in a convert_node() handler.
     """
-    result = ""
+    result = []
+    trailing_newline = False # does the output so far end with a newline?
     for child in node.children:
-        res = convert(child, context, result.endswith("\n"))
-        #if type(res) is str:
-        #    res = unicode(res)
-        #if type(res) is not unicode:
-        #    print("Got invalid response '%s' when processing '%s'" % (res,child))
+        res = yield (child, trailing_newline)
         if type(res) is not str:
             print("Got invalid response '%s' when processing '%s'" % (res,child))
-        result += res
-    return result
+        elif res:
+            trailing_newline = res.endswith("\n")
+        result.append(res)
+    return "".join(result)
 
 @visitor.when(Article)
-def convert(node, context, trailing_newline):
-    return convert_children(node, context)
+def convert_node(node, context, trailing_newline):
+    return (yield from convert_children(node, context))
 
 @visitor.when(Paragraph)
-def convert(node, context, trailing_newline):
-    return convert_children(node, context) + "\n"
+def convert_node(node, context, trailing_newline):
+    return (yield from convert_children(node, context)) + "\n"
+
+nowiki_placeholder = re.compile(r"<__yamdwe_nowiki>([0-9]+)</__yamdwe_nowiki>")
 
 @visitor.when(Text)
-def convert(text, context, trailing_newline):
+def convert_node(text, context, trailing_newline):
     if text._text is None:
         return ""
-    m = re.match(r"<__yamdwe_nowiki>([0-9]+)</__yamdwe_nowiki>", text._text)
+    m = nowiki_placeholder.match(text._text)
     if m is not None: # nowiki content!
         index = int(m.group(1))
         return context["nowiki_plaintext"][index] # nowiki_plaintext entry includes <nowiki> tags
@@ -109,42 +169,45 @@ def convert(text, context, trailing_newline):
         return text.caption
 
 @visitor.when(Section)
-def convert(section, context, trailing_newline):
+def convert_node(section, context, trailing_newline):
     result = ""
     if section.tagname == "p":
         pass
     elif section.tagname == "@section":
         level = section.level
-        heading = convert(section.children.pop(0), context, trailing_newline).strip()
+        heading = (yield (section.children.pop(0), trailing_newline)).strip()
         heading_boundary = "="*(8-level)
         result = "\n%s %s %s\n" % (heading_boundary, heading, heading_boundary)
     else:
         print("Unknown tagname %s" % section.tagname)
 
-    return result + convert_children(section, context)
+    return result + (yield from convert_children(section, context))
+
+# dict maps mediawiki style caption to tuple of starting, ending dokuwiki markup
+style_formatters = {
+    ";" :  ("**", r"**\\"),     # definition (essentially boldface)
+    "''" : ("//", "//"),        # italics
+    "'''" :("**", "**"),        # boldface "'''"
+    ":"   : ("", ""),           # other end of a definition???
+    "sub" : ("<sub>","</sub>"),
+    "sup" : ("<sup>","</sup>"),
+    "big" : ("**", "**"),       # <big> not in dokuwiki so use bold
+    "-" : ("<blockquote>", "</blockquote>"), # use dokuwikis Blockquote Plugin for this
+    "u" : ("", ""),              # <br> already handled in TagNode @visitor
+    "s" : ("<del>", "</del>")   # According to the mediawiki docs <s>..</s> is synonymous with <del>...</del> (although one is treates as a tag and one a style in the parser??)
+    }
 
 @visitor.when(Style)
-def convert(style, context, trailing_newline):
-    formatter = {
-        ";" :  ("**", r"**\\"),     # definition (essentially boldface)
-        "''" : ("//", "//"),        # italics
-        "'''" :("**", "**"),        # boldface "'''"
-        ":"   : ("", ""),           # other end of a definition???
-        "sub" : ("<sub>","</sub>"),
-        "sup" : ("<sup>","</sup>"),
-        "big" : ("**", "**"),       # <big> not in dokuwiki so use bold
-        "-" : ("<blockquote>", "</blockquote>"), # use dokuwikis Blockquote Plugin for this
-        "u" : ("", ""),              # <br> already handled in TagNode @visitor
-        "s" : ("<del>", "</del>")   # According to the mediawiki docs <s>..</s> is synonymous with <del>...</del> (although one is treates as a tag and one a style in the parser??)
-        }.get(style.caption, None)
+def convert_node(style, context, trailing_newline):
+    formatter = style_formatters.get(style.caption, None)
     if formatter is None:
         print("WARNING: Ignoring unknown formatter %s" % style.caption)
         formatter = ("","")
-    return formatter[0] + convert_children(style, context) + formatter[1]
+    return formatter[0] + (yield from convert_children(style, context)) + formatter[1]
 
 @visitor.when(NamedURL)
-def convert(url, context, trailing_newline):
-    text = convert_children(url, context).strip(" ")
+def convert_node(url, context, trailing_newline):
+    text = (yield from convert_children(url, context)).strip(" ")
     url = url.caption
     if len(text):
         return u"[[%s|%s]]" % (url, text)
@@ -152,11 +215,11 @@ def convert(url, context, trailing_newline):
         return u"%s" % (url)
 
 @visitor.when(URL)
-def convert(url, context, trailing_newline):
+def convert_node(url, context, trailing_newline):
     return url.caption
 
 @visitor.when(ImageLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     suffix = ""
     if link.width is not None:
         if link.height is None:
@@ -176,8 +239,8 @@ def convert(link, context, trailing_newline):
     return "{{%s%s%s%s}}" % (prealign, target, suffix, postalign)
 
 @visitor.when(ArticleLink)
-def convert(link, context, trailing_newline):
-    text = convert_children(link, context).strip(" ")
+def convert_node(link, context, trailing_newline):
+    text = (yield from convert_children(link, context)).strip(" ")
     pagename = convert_internal_link(link.target)
     if len(text):
         return u"[[%s|%s]]" % (pagename, text)
@@ -185,72 +248,73 @@ def convert(link, context, trailing_newline):
         return u"[[%s]]" % pagename
 
 @visitor.when(CategoryLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     # Category functionality can be implemented with plugin:tag, but not used here
     return ""
 
 @visitor.when(NamespaceLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     if is_file_namespace(link.target): # is a link to a file or image
         filename = dokuwiki.make_dokuwiki_pagename(canonicalise_file_namespace(link.target))
-        caption = convert_children(link, context).strip()
+        caption = (yield from convert_children(link, context)).strip()
         if len(caption) > 0:
             return u"{{%s%s}}" % (filename, caption)
         else:
             return u"{{%s}}" % filename
 
     print("WARNING: Ignoring namespace link to " + link.target)
-    return convert_children(link, context)
+    return (yield from convert_children(link, context))
 
 
 @visitor.when(ItemList)
-def convert(itemlist, context, trailing_newline):
+def convert_node(itemlist, context, trailing_newline):
     context["list_stack"].append("* " if itemlist.tagname == "ul" else "- ")
-    converted_list = convert_children(itemlist, context)
+    converted_list = (yield from convert_children(itemlist, context))
     context["list_stack"].pop()
     return converted_list
 
 @visitor.when(Item)
-def convert(item, context, trailing_newline):
-    item_content = convert_children(item, context)
+def convert_node(item, context, trailing_newline):
+    item_content = (yield from convert_children(item, context))
     list_stack = context["list_stack"]
     return "  "*len(list_stack) + list_stack[-1] + item_content
 
 @visitor.when(Table)
-def convert(table, context, trailing_newline):
+def convert_node(table, context, trailing_newline):
     # we ignore the actual Table tags, instead convert each Row & Cell individually
-    return convert_children(table, context)
+    return (yield from convert_children(table, context))
 
 @visitor.when(Cell)
-def convert(cell, context, trailing_newline):
+def convert_node(cell, context, trailing_newline):
     marker = "^" if cell.tagname == "th" else "|"
-    result = u"%s %s" % (marker, convert_children(cell, context).replace('\n','').strip())
+    result = u"%s %s" % (marker, (yield from convert_children(cell, context)).replace('\n','').strip())
     return result
 
 @visitor.when(Row)
-def convert(row, context, trailing_newline):
-    return convert_children(row, context) + " |\n"
+def convert_node(row, context, trailing_newline):
+    return (yield from convert_children(row, context)) + " |\n"
 
 @visitor.when(PreFormatted)
-def convert(pre, context, trailing_newline):
+def convert_node(pre, context, trailing_newline):
     in_list = len(context["list_stack"]) > 0
     if trailing_newline and not in_list: # in its own paragraph, use a two space indent
-        return "  " + convert_children(pre, context).replace("\n","\n  ").strip(" ")
+        return "  " + (yield from convert_children(pre, context)).replace("\n","\n  ").strip(" ")
     else: # inline in a list or a paragraph body, use <code> tags
-        return "<code>" + convert_children(pre, context) + "</code>"
+        return "<code>" + (yield from convert_children(pre, context)) + "</code>"
+
+# dict maps mediawiki tag name to tuple of starting, ending dokuwiki tag
+simple_tagitems = {
+    "tt" : ("''", "''"),
+    "ref" : ("((","))"), # references converted to footnotes
+    "code" : ("<code>","</code>"),
+    "del": ("<del>", "</del>"),
+}
 
 @visitor.when(TagNode)
-def convert(tag, context, trailing_newline):
-    # dict maps mediawiki tag name to tuple of starting, ending dokuwiki tag
-    simple_tagitems = {
-        "tt" : ("''", "''"),
-        "ref" : ("((","))"), # references converted to footnotes
-        "code" : ("<code>","</code>"),
-        "del": ("<del>", "</del>"),
-    }
+def convert_node(tag, context, trailing_newline):
     if tag.tagname in simple_tagitems:
         pre,post = simple_tagitems[tag.tagname]
-        return pre + convert_children(tag, context) + post
+        return pre + (yield from convert_children(tag, context)) + post
     elif tag._text is not None:
         if tag._text.replace(" ","").replace("/","") == "<br>":
             return "\n" # this is a oneoff hack for one wiki page covered in <br/>
@@ -264,10 +328,10 @@ def convert(tag, context, trailing_newline):
     elif tag.tagname == "references":
         print("WARNING: <references> tag has no equivalent in Dokuwiki, ignoring...")
 
-    return convert_children(tag, context)
+    return (yield from convert_children(tag, context))
 
 @visitor.when(Math)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
     """
     Convert <math></math> tags for rendering of math terms
     there are a couple of extension to support this in dokuwiki
@@ -281,7 +345,7 @@ def convert(node, context, trailing_newline):
 
 
 @visitor.when(Caption)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
 	"""
 	Convert table captions to bold paragraph preceeding the table.
 	
@@ -290,14 +354,14 @@ def convert(node, context, trailing_newline):
 	worrying about it being inside <table> (which <caption> should be)
 	in the rendered HTML.
 	"""
-	return "** %s **\n" % convert_children(node, context)
+	return "** %s **\n" % (yield from convert_children(node, context))
 
 # catchall for Node, which is the parent class of everything above
 @visitor.when(Node)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
     if node.__class__ != Node:
         print("WARNING: Unsupported node type: %s" % (node.__class__))
-    return convert_children(node, context)
+    return (yield from convert_children(node, context))
 
 def convert_internal_link(mw_target):
     """
@@ -311,7 +375,7 @@ def convert_internal_link(mw_target):
         page = mw_target
         anchor = None
     if len(page):
-        page = dokuwiki.make_dokuwiki_pagename(page)
+        page = title_index.get(page) if title_index is not None else dokuwiki.make_dokuwiki_pagename(page)
     if anchor is not None:
         page = page + "#" + dokuwiki.make_dokuwiki_heading_id(anchor)
     return page
@@ -7,6 +7,9 @@ Goes through every subdirectory of the tests/ directory. Each subdirectory conta
 * dokuwiki.txt -> correct Dokuwiki output to be expected.
 * notes.txt -> (optional) file describing what's special about this test.
 
+The deep_nesting test is also converted again from its parse tree with a low
+recursion limit, as the conversion (unlike mwlib's parser) shouldn't recurse.
+
 Converts mediawiki.txt and compares output to dokuwiki.txt, prints an
 error (and contents of notes.txt) if the output does not match.
 
@@ -70,6 +73,38 @@ def run_test(testdir):
     print(DELIMITER)
     return False
 
+def run_shallow_stack_test(testdir, recursion_limit=200):
+    """
+    Convert the parse tree of the test in 'testdir' with the recursion limit lowered
+    to 'recursion_limit', which is far less than its nesting.
+
+    Return True on success
+    """
+    print("Running %s with a recursion limit of %d..." % (testdir, recursion_limit))
+    mw = _readfile(testdir, "mediawiki.txt").strip()
+    dw = _readfile(testdir, "dokuwiki.txt").strip()
+    root = wikicontent.parse(os.path.split(testdir)[1], mw) # needs the deep recursion limit
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(recursion_limit)
+    try:
+        converted = wikicontent.convert(root, { "list_stack" : [], "nowiki_plaintext" : [] }, False).strip()
+    except RecursionError:
+        print("CONVERSION RECURSED")
+        traceback.print_exc()
+        print(DELIMITER)
+        return False
+    finally:
+        sys.setrecursionlimit(old_limit)
+    if converted == dw:
+        return True
+    print("OUTPUT MISMATCH")
+    print(DELIMITER)
+    diff = difflib.unified_diff(prep_difflines(dw), prep_difflines(converted), fromfile='Expected Dokuwiki', tofile='Actual Dokuwiki', lineterm="\n")
+    sys.stdout.writelines(diff)
+    sys.stdout.write("\n")
+    print(DELIMITER)
+    return False
+
 def tests_dirpath():
     """ Return path to the test directory """
     execdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -88,6 +123,9 @@ def run_all_tests():
             testsrun += 1
             if run_test(path):
                 successes += 1
+    testsrun += 1
+    if run_shallow_stack_test(os.path.join(testsdir, "deep_nesting")):
+        successes += 1
     print("--- %d/%d TESTS PASSED ---" % (successes, testsrun))
     return successes == testsrun
 
@@ -0,0 +1,51 @@
+"""
+Runs work on a pool a bounded number of items ahead of the code consuming the results,
+in the order of the items.
+
+Used to fetch page revisions, convert pages and transfer images concurrently, without
+ever holding more than a few items' results in memory.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import collections, contextlib, concurrent.futures
+
+def run_ahead(start, items, ahead):
+    """
+    Generator yielding (item, start(item)) for each of 'items' in order, having already called
+    start() for up to 'ahead' more items, so that the work it starts on a pool is under way
+    by the time those items are yielded. start() returns a Future, or a list of Futures
+    (and already computed values.)
+
+    If the generator is closed before the end, the Futures of the items started but not yet
+    yielded are cancelled.
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append((item, start(item)))
+            if len(pending) > ahead:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for item, started in pending:
+            for future in (started if isinstance(started, list) else [ started ]):
+                if isinstance(future, concurrent.futures.Future):
+                    future.cancel()
+
+def map_ordered(func, items, workers):
+    """
+    Generator yielding (item, func(item)) for each of 'items' in order.
+
+    With more than one worker the calls run concurrently on a thread pool of 'workers' threads,
+    at most twice as many items ahead of the item being yielded.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        # closed (cancelling what hasn't started) before the executor waits for what is still queued
+        with contextlib.closing(run_ahead(lambda item: executor.submit(func, item), items, workers * 2)) as started:
+            for item, future in started:
+                yield item, future.result()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Tests for running work a bounded number of items ahead of its consumer.
+
+Licensed under New BSD License as described in the file LICENSE.
+"""
+import threading, unittest, concurrent.futures
+import workqueue
+
+class RunAheadTests(unittest.TestCase):
+    def test_order_and_bound(self):
+        started = []
+        results = []
+        for item, value in workqueue.run_ahead(lambda item: started.append(item) or item * 2, range(10), 3):
+            # never more than 3 items started beyond the one being yielded
+            self.assertLessEqual(len(started), item + 4)
+            results.append((item, value))
+        self.assertEqual(results, [ (i, i * 2) for i in range(10) ])
+
+    def test_close_cancels_pending(self):
+        futures = []
+        def start(item):
+            futures.append(concurrent.futures.Future())
+            return [ futures[-1], "done" ] if item % 2 else futures[-1]
+        started = workqueue.run_ahead(start, range(10), 3)
+        self.assertEqual(next(started)[0], 0)
+        started.close()
+        self.assertFalse(futures[0].cancelled())
+        self.assertEqual([ future.cancelled() for future in futures[1:] ], [ True ] * 3)
+
+class MapOrderedTests(unittest.TestCase):
+    def test_single_worker(self):
+        self.assertEqual(list(workqueue.map_ordered(str, [ 3, 1, 2 ], 1)), [ (3, "3"), (1, "1"), (2, "2") ])
+
+    def test_threads_keep_order(self):
+        threads = set()
+        def func(item):
+            threads.add(threading.current_thread())
+            return item * item
+        self.assertEqual(list(workqueue.map_ordered(func, range(100), 4)), [ (i, i * i) for i in range(100) ])
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_close_early(self):
+        calls = []
+        results = workqueue.map_ordered(calls.append, iter(range(1000)), 2)
+        next(results)
+        results.close()
+        self.assertLessEqual(len(calls), 5)
+
+    def test_exception(self):
+        def func(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+        with self.assertRaises(ValueError):
+            list(workqueue.map_ordered(func, range(10), 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,21 +12,21 @@ Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
 #from __future__ import print_function, unicode_literals, absolute_import, division
-import argparse, sys, codecs, locale, getpass, datetime, json
+import argparse, sys, codecs, locale, getpass, datetime, json, os.path
 #from pprint import pprint
-import mediawiki, dokuwiki, wikicontent
+import mediawiki, mediawikidump, dokuwiki, wikicontent, runstate
 # only needed to check for domain functionality
 import simplemediawiki, inspect
 
 def main():
-    # the wikicontent code (that uses visitor module) tends to recurse quite deeply for complex pages
-    sys.setrecursionlimit(20000)
-
     # try not to crash if the output/console has a character we can't encode
     #sys.stdout = codecs.getwriter(locale.getpreferredencoding())(sys.stdout, "replace")
 
     args = arguments.parse_args()
 
+    # before any threads are started, so that pages can be parsed on any of them
+    wikicontent.allow_deep_parsing()
+
     if args.http_pass is not None and args.http_user is None:
         raise RuntimeError("ERROR: Option --http_pass requires --http_user to also be specified")
     if args.wiki_pass is not None and args.wiki_user is None:
@@ -44,26 +44,126 @@ def main():
     #    importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.wiki_domain, args.verbose, args.query_delay)
     #else:
     #    importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.verbose, args.query_delay)
-    importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.verbose, args.query_delay)
-    exporter = dokuwiki.Exporter(args.dokuwiki)
+    # Pages can come from an XML dump instead of the API. Images always come from the API, unless listed in --partial_images
+    dump = mediawikidump.DumpImporter(args.xml_dump) if args.xml_dump else None
+    importer = None
+    if dump is None or not args.partial_images:
+        importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.verbose, args.query_delay, args.fetch_batch, args.fetch_workers,
+                                      cookie_file=args.cookie_file, pool_size=max(args.http_pool_size, args.image_workers), timeout=args.http_timeout)
+    source = dump if dump is not None else importer
+    exporter = dokuwiki.Exporter(args.dokuwiki, args.jobs, args.attic_compresslevel, args.attic_dedup)
+    # Journal of export progress, so an interrupted export can be picked up again with --resume
+    checkpoint = runstate.Checkpoint(args.checkpoint or os.path.join(exporter.data, "yamdwe.checkpoint"), args.resume)
+    exporter.checkpoint = checkpoint
 
     # Set the wikicontent's definition of File: and Image: prefixes (varies by language settings)
-    canonical_file, aliases = importer.get_file_namespaces()
+    canonical_file, aliases = source.get_file_namespaces()
     canonical_file = "File"  # Hard-coding this
     wikicontent.set_file_namespaces(canonical_file, aliases)
+    # Links to the pages being exported are looked up in the exporter's title index
+    wikicontent.title_index = exporter.titles
+
+    # Mediawiki server time as this export starts (or as the export being resumed started), saved once it
+    # completes so a later --incremental export can start from there
+    # (with an XML dump, --incremental only relies on the revisions already recorded for each page)
+    sync = runstate.SyncState(os.path.join(exporter.data, "yamdwe.sync"))
+    since = None
+    if dump is None:
+        sync_start = checkpoint.sync_start
+        if sync_start is None:
+            sync_start = importer.get_server_time()
+            checkpoint.record_sync_start(sync_start)
+    if args.incremental and dump is None:
+        if sync.timestamp is None:
+            raise RuntimeError("No previous export to sync from (%s not found.) Run a full export first." % sync.path)
+        since = sync.timestamp
+        print("Exporting changes made since %s..." % since)
+    # changed pages are listed from the wiki's recent changes, unless they don't go back far enough
+    list_changes = since is not None and importer.recent_changes_reach(since)
+    if since is not None and not list_changes:
+        print("WARNING: The mediawiki's recent changes don't go back to %s, checking every page for new revisions instead." % since)
+
+    if checkpoint.phase_done("pages"):
+        print("All pages were already exported, resuming with images...")
+    else:
+        # Reuse previously converted page content where possible
+        if args.cache:
+            exporter.use_cache(args.cache, args.cache_size * 1024 * 1024)
+
+        partial_pages = None
+        if args.partial_pages:
+            with open(args.partial_pages, mode='r', encoding="utf-8") as f:
+                partial_pages = json.load(f)
+
+        if dump is not None:
+            # Stream pages with their revisions straight out of the dump
+            pages = dump.get_all_pages()
+            if partial_pages is not None:
+                wanted = set(page['title'] for page in partial_pages)
+                pages = (page for page in pages if page['title'] in wanted)
+        else:
+            # Read the list of all (wanted) pages, revisions are then fetched page by page while exporting
+            if partial_pages is not None:
+                page_list = partial_pages
+                if list_changes:
+                    wanted = set(page['title'] for page in page_list)
+                    page_list = [ page for page in importer.get_changed_pages(since) if page['title'] in wanted ]
+            elif list_changes:
+                page_list = importer.get_changed_pages(since, namespace=0) # same namespace as allpages
+            else:
+                page_list = importer.get_page_list()
+            print("Found %d pages to export..." % len(page_list))
+            exporter.titles.add_all(page['title'] for page in page_list)
+            if args.resume:
+                page_list = [ page for page in page_list if not checkpoint.page_done(page) ]
+                print("Resuming, %d pages left to export..." % len(page_list))
+            pages = importer.get_page_revisions(page_list, since)
+
+        # Add a shameless "exported by yamdwe" note to the front page of the wiki
+        if not args.incremental:
+            mainpage = source.get_main_pagetitle()
+            pages = add_yamdwe_note(pages, mainpage)
+
+        # Export pages to Dokuwiki format
+        exporter.write_pages(pages, incremental=args.incremental)
 
-    # Read all (wanted) pages and page revisions
-    if args.partial_pages:
-        with open(args.partial_pages, mode='r', encoding="utf-8") as f:
-            partial_pages_info = json.load(f)
-            pages = importer.get_partial_pages(partial_pages_info)
+    # Bring over images
+    if checkpoint.phase_done("images"):
+        print("All images were already exported.")
     else:
-        pages = importer.get_all_pages()
-    print("Found %d pages to export..." % len(pages))
+        if args.partial_images:
+            with open(args.partial_images, mode='r', encoding="utf-8") as f:
+                images = json.load(f)
+            if since is not None:
+                images = [ image for image in images if image['timestamp'] >= since ]
+        else:
+            images = importer.get_all_images(since)
+        print("Found %d images to export..." % len(images))
+        exporter.write_images(images, canonical_file, args.http_user, args.http_pass, importer.session if importer else None,
+                               args.image_workers, args.http_timeout, args.image_retries, args.images_dir, args.link_images)
+
+    if dump is None:
+        if checkpoint.phase_done("pages") and checkpoint.phase_done("images"):
+            sync.save(sync_start)
+        else:
+            print("The export is incomplete, so it isn't recorded for --incremental. Run again with --resume to finish it.")
+    checkpoint.close()
 
-    # Add a shameless "exported by yamdwe" note to the front page of the wiki
-    mainpage = importer.get_main_pagetitle()
+    # fix permissions on data directory if possible
+    exporter.fixup_permissions(args.fix_all_permissions)
 
+    # touch conf file to invalidate cached pages
+    exporter.invalidate_cache()
+
+    if importer is not None:
+        importer.close()
+    print("Done.")
+
+def add_yamdwe_note(pages, mainpage):
+    """
+    Generator passing 'pages' through, adding a shameless "exported by yamdwe" note
+    as the newest revision of the main page when it goes by.
+    """
     for page in pages:
         if page["title"] == mainpage:
             latest = dict(page["revisions"][0])
@@ -73,26 +173,7 @@ def main():
             latest["comment"] = "Automated note about use of yamdwe Dokuwiki import tool"
             latest["*"] += "\n\n(Automatically exported to Dokuwiki from Mediawiki by [https://github.com/projectgus/yamdwe Yamdwe] on %s.)" % (datetime.date.today().strftime("%x"))
             page["revisions"].insert(0, latest)
-
-    # Export pages to Dokuwiki format
-    exporter.write_pages(pages)
-
-    # Bring over images
-    if args.partial_images:
-        with open(args.partial_images, mode='r', encoding="utf-8") as f:
-            images = json.load(f)
-    else:
-        images = importer.get_all_images()
-    print("Found %d images to export..." % len(images))
-    exporter.write_images(images, canonical_file, args.http_user, args.http_pass)
-
-    # fix permissions on data directory if possible
-    exporter.fixup_permissions()
-
-    # touch conf file to invalidate cached pages
-    exporter.invalidate_cache()
-
-    print("Done.")
+        yield page
 
 # Parser for command line arguments
 arguments = argparse.ArgumentParser(description='Convert a Mediawiki installation to a Dokuwiki installation.')
@@ -107,7 +188,26 @@ arguments.add_argument('--wiki_pass', help="Mediawiki login password (if --wiki_
 arguments.add_argument('-v', '--verbose',help="Print verbose progress and error messages", action="store_true")
 arguments.add_argument('--partial_pages', help="Read this file for the page data instead of getting all_pages from the mediawiki")
 arguments.add_argument('--partial_images', help="Read this file for the image data instead of getting all_images from the mediawiki")
-arguments.add_argument('--query_delay', default=0, type=float, help="Sleep this amount of seconds between queries to mediawiki")
+arguments.add_argument('--query_delay', default=0, type=float, help="Limit queries to mediawiki to one per this amount of seconds (shared by all fetch workers)")
+arguments.add_argument('--fetch_batch', default=0, type=int, help="Fetch the latest revisions of up to this many pages (max 50, or 500 with apihighlimits) in each query, older revisions are then fetched per page. Saves many queries on wikis with lots of short page histories")
+arguments.add_argument('--fetch_workers', default=1, type=int, help="Fetch page revisions with this many concurrent queries (combine with --query_delay to cap the total query rate)")
+arguments.add_argument('--http_pool_size', default=10, type=int, help="Number of keep-alive HTTP connections to keep open to the mediawiki server")
+arguments.add_argument('--image_workers', default=4, type=int, help="Download (or copy from --images_dir) this many images at once")
+arguments.add_argument('--images_dir', help="Copy images from this locally mounted mediawiki images directory (with the default hashed a/ab/ layout) instead of downloading them")
+arguments.add_argument('--link_images', help="With --images_dir, hardlink the images instead of copying them where possible (images without the permissions and ownership of the dokuwiki data directory are still copied)", action="store_true")
+arguments.add_argument('--image_retries', default=3, type=int, help="Retry a failed image download this many times, resuming from where it stopped")
+arguments.add_argument('--http_timeout', type=float, help="Timeout in seconds for connecting to and reading from the mediawiki server (default is to wait forever)")
+arguments.add_argument('--cookie_file', help="Load mediawiki session cookies from this file, and save them back after logging in and when done")
+arguments.add_argument('-j', '--jobs', default=1, type=int, help="Convert page content with this many worker processes")
+arguments.add_argument('--attic_compresslevel', default=9, type=int, choices=range(10), metavar="LEVEL", help="gzip compression level (0-9) of the old page revisions written to the dokuwiki attic, lower is faster (default 9)")
+arguments.add_argument('--attic_dedup', default="page", choices=("none", "page", "wiki"), help="Hardlink old page revisions in the dokuwiki attic to identical ones written before: within the same page's history (default), across the whole wiki, or not at all")
+arguments.add_argument('--cache', help="Cache converted page content in this SQLite file, so unchanged revisions aren't converted again by later exports")
+arguments.add_argument('--cache_size', default=1024, type=int, help="Maximum size of converted content kept in the --cache file, in MB (0 for no limit)")
+arguments.add_argument('--resume', help="Resume an interrupted export, skipping the pages and images it already exported", action="store_true")
+arguments.add_argument('--checkpoint', help="Journal file recording export progress for --resume (default is yamdwe.checkpoint in the dokuwiki data directory)")
+arguments.add_argument('--incremental', help="Only export the page revisions and images added since the last complete export into this dokuwiki, appending them to the existing page histories", action="store_true")
+arguments.add_argument('--fix_all_permissions', help="Fix the permissions of everything under the dokuwiki data directory, not just of what this export wrote", action="store_true")
+arguments.add_argument('--xml_dump', help="Read pages and their revisions from this mediawiki XML dump file (optionally .gz, .bz2 or .xz compressed) instead of the API. Combine with --partial_images to export without connecting to the mediawiki at all")
 arguments.add_argument('mediawiki', metavar='MEDIAWIKI_API_URL', help="URL of mediawiki's api.php file (something like http://mysite/wiki/api.php)")
 arguments.add_argument('dokuwiki', metavar='DOKUWIKI_ROOT', help="Root path to an existing dokuwiki installation to add the Mediawiki pages to (can be a brand new install.)")
 